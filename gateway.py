@@ -0,0 +1,485 @@
+"""
+Perplexity 스트리밍 게이트웨이
+하나의 PerplexityClient(연결 풀), 응답 캐시, 요청 제한기를 여러 Streamlit 워커와 내부 도구가
+공유하도록 OpenAI 호환 `/chat/completions` 엔드포인트(SSE 스트리밍 포함)를 제공합니다.
+같은 본문의 스트리밍 요청이 동시에 들어오면 업스트림 스트림 하나를 열어 모든 구독자에게 나눠 보냅니다.
+
+사용 예:
+    python gateway.py --port 8787
+    PERPLEXITY_BASE_URL=http://localhost:8787 PERPLEXITY_API_KEY=<GATEWAY_API_KEY> streamlit run perplexity_chat_app.py
+"""
+
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+from dotenv import load_dotenv
+
+# 게이트웨이 설정(GATEWAY_*)과 모듈 설정은 임포트 시점에 환경 변수에서 읽으므로 .env를 먼저 로드
+load_dotenv()
+
+from modules.api_client import PerplexityClient
+from modules.cassette import transport_from_env
+
+# 동시에 열 수 있는 업스트림 요청 수
+MAX_CONCURRENCY = int(os.getenv("GATEWAY_MAX_CONCURRENCY", 16))
+
+# 분당 업스트림 요청 수 (0이면 제한 없음)
+RATE_PER_MINUTE = int(os.getenv("GATEWAY_RATE_PER_MINUTE", 50))
+
+# 완료된 스트리밍 응답을 같은 요청에 재사용하는 시간(초, 0이면 캐시 사용 안 함)
+CACHE_TTL = float(os.getenv("GATEWAY_CACHE_TTL", 60))
+
+# 캐시에 보관할 최대 응답 수
+CACHE_MAX_ENTRIES = int(os.getenv("GATEWAY_CACHE_MAX_ENTRIES", 256))
+
+# 제한기 대기 최대 시간(초) - 넘으면 429로 응답
+LIMITER_TIMEOUT = 30
+
+# 게이트웨이 이용 키 (설정하면 Authorization: Bearer 값이 일치해야 함)
+GATEWAY_API_KEY = os.getenv("GATEWAY_API_KEY")
+
+
+def request_key(payload):
+    """
+    요청 본문으로 병합/캐시 키를 계산합니다.
+
+    Returns:
+        str: SHA-256 16진수 문자열
+    """
+    canonical = json.dumps(payload, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class RateLimiter:
+    """동시 업스트림 요청 수와 분당 요청 수를 함께 제한하는 제한기"""
+
+    def __init__(self, max_concurrency=MAX_CONCURRENCY, rate_per_minute=RATE_PER_MINUTE):
+        """
+        Args:
+            max_concurrency (int): 동시에 열 수 있는 업스트림 요청 수
+            rate_per_minute (int): 분당 요청 수 (0이면 제한 없음)
+        """
+        self.rate = rate_per_minute / 60.0
+        self.capacity = float(max(1, rate_per_minute))
+        self._tokens = self.capacity
+        self._refilled_at = time.monotonic()
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._lock = threading.Lock()
+
+    def _take_token(self):
+        """토큰 하나를 가져옵니다. 부족하면 다음 토큰까지 기다려야 할 시간(초)을 반환합니다."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._refilled_at) * self.rate)
+            self._refilled_at = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate
+
+    def acquire(self, timeout=LIMITER_TIMEOUT):
+        """
+        업스트림 요청 슬롯을 얻습니다.
+
+        Returns:
+            bool: timeout 안에 얻었는지 여부
+        """
+        deadline = time.monotonic() + timeout
+        if not self._slots.acquire(timeout=timeout):
+            return False
+        if not self.rate:
+            return True
+        while True:
+            wait = self._take_token()
+            if not wait:
+                return True
+            if time.monotonic() + wait > deadline:
+                self._slots.release()
+                return False
+            time.sleep(wait)
+
+    def release(self):
+        """업스트림 요청 슬롯을 반환합니다."""
+        self._slots.release()
+
+
+class GatewayError(Exception):
+    """업스트림 오류를 HTTP 상태 코드와 함께 전달하는 예외"""
+
+    def __init__(self, status_code, message):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def _mark_shared_usage(event, source):
+    """
+    병합/캐시로 재사용한 이벤트의 usage에 출처를 표시한 사본을 반환합니다
+    (방송의 이벤트는 구독자끼리 공유하므로 원본은 수정하지 않음).
+    """
+    usage = event.get("usage")
+    if not isinstance(usage, dict):
+        return event
+    return dict(event, usage=dict(usage, gateway_source=source))
+
+
+class _Broadcast:
+    """업스트림 스트림 하나를 읽어 여러 구독자에게 나눠 보내는 방송"""
+
+    def __init__(self, key, on_finished):
+        """
+        Args:
+            key (str): 요청 키
+            on_finished (callable): 방송이 끝났을 때 방송 객체를 인자로 호출할 함수
+        """
+        self.key = key
+        self.events = []
+        self.error = None
+        self.done = False
+        self.subscribers = 0
+        self.stream = None
+        self._on_finished = on_finished
+        self._cond = threading.Condition()
+
+    @property
+    def completed(self):
+        """업스트림 응답을 끝까지 받았는지 여부 (캐시 가능 여부)"""
+        return self.done and self.error is None
+
+    def run(self, client, payload, limiter):
+        """워커 스레드에서 업스트림 스트림을 끝까지 읽습니다."""
+        if not limiter.acquire():
+            self._finish(error=(429, "게이트웨이 요청 한도를 초과했습니다."))
+            return
+        try:
+            if self.done:
+                # 제한기를 기다리는 동안 모든 구독자가 떠난 경우
+                return
+            self.stream = client.stream_chat(payload)
+            for event in self.stream:
+                with self._cond:
+                    self.events.append(event)
+                    self._cond.notify_all()
+            self._finish()
+        except httpx.HTTPStatusError as e:
+            self._finish(error=(e.response.status_code, str(e)))
+        except Exception as e:
+            self._finish(error=(502, str(e)))
+        finally:
+            limiter.release()
+
+    def _finish(self, error=None):
+        with self._cond:
+            if self.done:
+                return
+            self.error = error
+            self.done = True
+            self._cond.notify_all()
+        self._on_finished(self)
+
+    def subscribe(self):
+        with self._cond:
+            self.subscribers += 1
+
+    def unsubscribe(self):
+        """
+        구독을 해지합니다. 마지막 구독자가 끝나기 전에 나가면 업스트림 연결을 닫습니다.
+        """
+        with self._cond:
+            self.subscribers -= 1
+            abandoned = self.subscribers == 0 and not self.done
+        if abandoned:
+            if self.stream is not None:
+                self.stream.close()
+            self._finish(error=(499, "모든 구독자가 연결을 끊었습니다."))
+
+    def iter_events(self, source="upstream"):
+        """
+        처음부터 이벤트를 내보냅니다 (늦게 합류한 구독자도 앞부분을 다시 받음).
+
+        Args:
+            source (str): 구독 출처 ("upstream"이 아니면 usage에 출처를 표시하여
+                클라이언트가 업스트림 호출 한 번을 여러 번 집계하지 않게 함)
+
+        Raises:
+            GatewayError: 업스트림 요청이 실패한 경우
+        """
+        if source != "upstream":
+            for event in self.iter_events():
+                yield _mark_shared_usage(event, source)
+            return
+
+        offset = 0
+        while True:
+            with self._cond:
+                while offset >= len(self.events) and not self.done:
+                    self._cond.wait()
+                events = self.events[offset:]
+                done, error = self.done, self.error
+            offset += len(events)
+            yield from events
+            if done and offset >= len(self.events):
+                if error is not None:
+                    raise GatewayError(*error)
+                return
+
+
+class StreamCoalescer:
+    """같은 스트리밍 요청을 하나의 업스트림 스트림으로 병합하고 완료된 응답을 캐시하는 클래스"""
+
+    def __init__(self, client, limiter, cache_ttl=CACHE_TTL, cache_max_entries=CACHE_MAX_ENTRIES):
+        """
+        Args:
+            client (PerplexityClient): 업스트림 요청에 사용할 공유 클라이언트
+            limiter (RateLimiter): 업스트림 요청 제한기
+            cache_ttl (float): 완료된 응답을 재사용하는 시간(초, 0이면 캐시 사용 안 함)
+            cache_max_entries (int): 캐시에 보관할 최대 응답 수
+        """
+        self.client = client
+        self.limiter = limiter
+        self.cache_ttl = cache_ttl
+        self.cache_max_entries = cache_max_entries
+        self._inflight = {}
+        self._cache = OrderedDict()  # 키 -> (완료 시각, 방송)
+        self._lock = threading.Lock()
+        self.stats = {"upstream": 0, "coalesced": 0, "cache_hits": 0}
+
+    def open(self, payload):
+        """
+        요청에 해당하는 방송을 구독합니다. 진행 중이거나 캐시된 방송이 있으면 재사용합니다.
+
+        Args:
+            payload (dict): /chat/completions 요청 본문
+
+        Returns:
+            tuple: (방송, 출처 "upstream" | "coalesced" | "cache")
+        """
+        key = request_key(payload)
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                finished_at, broadcast = cached
+                if time.monotonic() - finished_at <= self.cache_ttl:
+                    self._cache.move_to_end(key)
+                    self.stats["cache_hits"] += 1
+                    broadcast.subscribe()
+                    return broadcast, "cache"
+                del self._cache[key]
+
+            broadcast = self._inflight.get(key)
+            if broadcast is not None:
+                self.stats["coalesced"] += 1
+                broadcast.subscribe()
+                return broadcast, "coalesced"
+
+            broadcast = _Broadcast(key, self._finished)
+            broadcast.subscribe()
+            self._inflight[key] = broadcast
+            self.stats["upstream"] += 1
+
+        threading.Thread(
+            target=broadcast.run,
+            args=(self.client, payload, self.limiter),
+            name="gateway-upstream",
+            daemon=True,
+        ).start()
+        return broadcast, "upstream"
+
+    def _finished(self, broadcast):
+        with self._lock:
+            if self._inflight.get(broadcast.key) is broadcast:
+                del self._inflight[broadcast.key]
+            if broadcast.completed and self.cache_ttl > 0:
+                self._cache[broadcast.key] = (time.monotonic(), broadcast)
+                while len(self._cache) > self.cache_max_entries:
+                    self._cache.popitem(last=False)
+
+
+class GatewayHandler(BaseHTTPRequestHandler):
+    """OpenAI 호환 /chat/completions 요청을 처리하는 핸들러"""
+
+    server_version = "PerplexityGateway/1.0"
+
+    @property
+    def gateway(self):
+        return self.server.gateway
+
+    def _send_json(self, status_code, body):
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status_code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_error_json(self, status_code, message):
+        self._send_json(status_code, {"error": {"message": message, "code": status_code}})
+
+    def _authorized(self):
+        if not GATEWAY_API_KEY:
+            return True
+        if self.headers.get("Authorization") == f"Bearer {GATEWAY_API_KEY}":
+            return True
+        self._send_error_json(401, "게이트웨이 API 키가 올바르지 않습니다.")
+        return False
+
+    def _relay(self, response):
+        """업스트림 응답을 그대로 전달합니다."""
+        self.send_response(response.status_code)
+        self.send_header("Content-Type", response.headers.get("content-type", "application/json"))
+        self.send_header("Content-Length", str(len(response.content)))
+        self.end_headers()
+        self.wfile.write(response.content)
+
+    def do_GET(self):
+        if self.path == "/health":
+            self._send_json(200, {"status": "ok", **self.gateway.coalescer.stats})
+            return
+        if not self.path.startswith("/chat/completions/"):
+            self._send_error_json(404, "지원하지 않는 경로입니다.")
+            return
+        if not self._authorized():
+            return
+        # 비동기 요청 결과 조회
+        try:
+            self._relay(self.gateway.client.request("GET", self.path))
+        except httpx.HTTPError as e:
+            self._send_error_json(502, str(e))
+
+    def do_POST(self):
+        if self.path.rstrip("/") != "/chat/completions":
+            self._send_error_json(404, "지원하지 않는 경로입니다.")
+            return
+        if not self._authorized():
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            payload = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            self._send_error_json(400, "요청 본문이 올바른 JSON이 아닙니다.")
+            return
+
+        if payload.get("stream"):
+            self._stream(payload)
+            return
+
+        limiter = self.gateway.limiter
+        if not limiter.acquire():
+            self._send_error_json(429, "게이트웨이 요청 한도를 초과했습니다.")
+            return
+        try:
+            self._relay(self.gateway.client.request("POST", "/chat/completions", payload))
+        except httpx.HTTPError as e:
+            self._send_error_json(502, str(e))
+        finally:
+            limiter.release()
+
+    def _stream(self, payload):
+        broadcast, source = self.gateway.coalescer.open(payload)
+        events = broadcast.iter_events(source)
+        try:
+            # 첫 이벤트 전에 업스트림이 실패하면 일반 오류 응답으로 전달
+            try:
+                first = next(events)
+            except StopIteration:
+                first = None
+            except GatewayError as e:
+                self._send_error_json(e.status_code, str(e))
+                return
+
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header("Connection", "close")
+            self.send_header("X-Gateway-Source", source)
+            self.end_headers()
+            self.close_connection = True
+
+            if first is not None:
+                self._write_event(first)
+                try:
+                    for event in events:
+                        self._write_event(event)
+                except GatewayError as e:
+                    # 스트림 도중 실패하면 오류 이벤트를 보내고 종료
+                    self._write_event({"error": {"message": str(e), "code": e.status_code}})
+                    return
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            broadcast.unsubscribe()
+
+    def _write_event(self, event):
+        self.wfile.write(b"data: " + json.dumps(event, ensure_ascii=False).encode("utf-8") + b"\n\n")
+        self.wfile.flush()
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class Gateway:
+    """게이트웨이 서버와 공유 클라이언트/캐시/제한기를 묶는 클래스"""
+
+    def __init__(self, client, host="127.0.0.1", port=8787, limiter=None, verbose=False):
+        """
+        Args:
+            client (PerplexityClient): 업스트림 요청에 사용할 공유 클라이언트
+            host (str): 바인딩할 주소
+            port (int): 바인딩할 포트
+            limiter (RateLimiter): 업스트림 요청 제한기 (None이면 기본 설정으로 생성)
+            verbose (bool): 요청 로그 출력 여부
+        """
+        self.client = client
+        self.limiter = limiter or RateLimiter()
+        self.coalescer = StreamCoalescer(client, self.limiter)
+        self.server = ThreadingHTTPServer((host, port), GatewayHandler)
+        self.server.daemon_threads = True
+        self.server.gateway = self
+        self.server.verbose = verbose
+
+    @property
+    def address(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def serve_forever(self):
+        self.server.serve_forever()
+
+    def shutdown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Perplexity API 스트리밍 게이트웨이를 실행합니다.")
+    parser.add_argument("--host", default="127.0.0.1", help="바인딩할 주소")
+    parser.add_argument("--port", type=int, default=8787, help="바인딩할 포트")
+    parser.add_argument("--verbose", action="store_true", help="요청 로그 출력")
+    args = parser.parse_args()
+
+    api_key = os.getenv("PERPLEXITY_API_KEY")
+    if not api_key:
+        raise SystemExit("PERPLEXITY_API_KEY가 설정되지 않았습니다.")
+
+    # 게이트웨이는 항상 Perplexity API에 직접 연결 (PERPLEXITY_BASE_URL은 앱 쪽 설정)
+    gateway = Gateway(
+        PerplexityClient(api_key, transport=transport_from_env()),
+        host=args.host,
+        port=args.port,
+        verbose=args.verbose,
+    )
+    print(f"게이트웨이 실행 중: {gateway.address}")
+    try:
+        gateway.serve_forever()
+    except KeyboardInterrupt:
+        gateway.shutdown()
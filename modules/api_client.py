@@ -4,40 +4,183 @@ API 호출 및 응답 처리 관련 기능을 제공합니다.
 """
 
 import json
+import time
+import queue
+import threading
 import httpx
 from openai import OpenAI
 import streamlit as st
+from modules.hedging import HedgedStream, TimedStream, close_stream
+from modules.payload_builder import EncodedMessages
+
+# 스트림 대기 중 취소/재실행 여부를 확인하는 주기(초)
+CANCEL_POLL_INTERVAL = 0.2
+
+# 기본 API 주소 (PERPLEXITY_BASE_URL로 게이트웨이 등 다른 주소를 지정할 수 있음)
+DEFAULT_BASE_URL = "https://api.perplexity.ai"
+
+# 직접 호출 요청의 타임아웃(초, 연결/읽기 각각) - 긴 스트림과 비동기 응답을 고려해 넉넉하게 설정
+REQUEST_TIMEOUT = httpx.Timeout(600.0, connect=10.0)
+
+
+def _body_kwargs(headers, payload):
+    """
+    요청 본문에 맞는 httpx 요청 인자를 만듭니다.
+    dict는 JSON으로 직렬화하고, 미리 직렬화된 본문(RequestBody)은 조각을 합치지 않고 전송하도록
+    길이를 미리 지정합니다 (chunked 인코딩 방지).
+    """
+    if payload is None or isinstance(payload, dict):
+        return {"headers": headers, "json": payload}
+    return {
+        "headers": dict(headers, **{"Content-Length": str(len(payload))}),
+        "content": payload,
+    }
+
+
+class SSEStream:
+    """
+    httpx로 직접 요청한 SSE 응답 스트림.
+    반복 중인 응답 객체를 `response` 속성으로 노출하여 다른 스레드에서도 연결을 닫을 수 있습니다.
+    """
+
+    def __init__(self, url, headers, payload, transport=None, client=None):
+        """
+        Args:
+            url (str): 요청 URL
+            headers (dict): 요청 헤더
+            payload (dict | RequestBody): 요청 본문 (미리 직렬화된 본문은 그대로 전송)
+            transport (httpx.BaseTransport): 사용할 httpx 트랜스포트 (녹화/재생용, 기본값 None)
+            client (httpx.Client): 연결 풀을 공유할 httpx 클라이언트
+                (None이면 요청마다 새 클라이언트를 만들고 끝나면 닫음)
+        """
+        self.url = url
+        self.headers = headers
+        self.payload = payload
+        self.transport = transport
+        self.client = client
+        self.response = None
+        # close()가 호출되었는지 여부 (응답 헤더가 도착하기 전에 닫힌 경우 확인용)
+        self._closed = False
+
+    def __iter__(self):
+        if self.client is not None:
+            yield from self._iter_events(self.client)
+            return
+        with httpx.Client(transport=self.transport) as client:
+            yield from self._iter_events(client)
+
+    def _iter_events(self, client):
+        if self._closed:
+            return
+        with client.stream("POST", self.url, **_body_kwargs(self.headers, self.payload)) as response:
+            self.response = response
+            # 응답 헤더를 기다리는 동안 닫혔으면 본문을 읽지 않고 바로 연결을 닫음
+            if self._closed:
+                response.close()
+                return
+            # Ensure the response is successful
+            response.raise_for_status()
+
+            for line in response.iter_lines():
+                if self._closed:
+                    break
+                if line:
+                    # line is already a string from response.iter_lines()
+                    if line.startswith("data: "):
+                        line = line[6:]  # 'data: ' 접두사 제거
+                        if line != "[DONE]":
+                            try:
+                                chunk_data = json.loads(line)
+                                # citations 정보가 있으면 함께 전달
+                                yield chunk_data
+                            except json.JSONDecodeError:
+                                # Handle cases where a line might not be valid JSON
+                                # or is an empty data field
+                                pass
+
+    def close(self):
+        """업스트림 연결을 닫습니다 (응답 헤더가 도착하기 전이면 도착하는 즉시 닫힘)."""
+        self._closed = True
+        if self.response is not None:
+            self.response.close()
 
 
 class PerplexityClient:
     """Perplexity API 클라이언트 클래스"""
 
-    def __init__(self, api_key):
+    def __init__(self, api_key, transport=None, base_url=None):
         """
         Perplexity API 클라이언트 초기화
 
         Args:
-            api_key (str): Perplexity API 키
+            api_key (str): Perplexity API 키 (게이트웨이를 사용하면 게이트웨이 키)
+            transport (httpx.BaseTransport): 모든 요청에 사용할 httpx 트랜스포트
+                (카세트 녹화/재생용, 기본값 None이면 일반 네트워크 트랜스포트)
+            base_url (str): API 주소 (게이트웨이 주소 등, 기본값 None이면 Perplexity API)
         """
         self.api_key = api_key
-        self.base_url = "https://api.perplexity.ai"
+        self.base_url = (base_url or DEFAULT_BASE_URL).rstrip("/")
+        self.transport = transport
+        # 스트리밍/비동기/직접 호출이 하나의 연결 풀을 공유
+        self.http_client = httpx.Client(transport=transport, timeout=REQUEST_TIMEOUT)
         self.openai_client = OpenAI(
-            api_key=api_key, base_url=self.base_url, http_client=httpx.Client()
+            api_key=api_key, base_url=self.base_url, http_client=self.http_client
+        )
+
+    def _headers(self):
+        return {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json",
+        }
+
+    def stream_chat(self, payload):
+        """
+        OpenAI 호환 요청 본문을 그대로 보내고 SSE 이벤트(dict)를 순서대로 내보내는 스트림을 반환합니다.
+
+        Args:
+            payload (dict): /chat/completions 요청 본문 (stream은 항상 True로 보냄)
+
+        Returns:
+            SSEStream: 응답 스트림
+        """
+        return SSEStream(
+            f"{self.base_url}/chat/completions",
+            headers=self._headers(),
+            payload=dict(payload, stream=True),
+            client=self.http_client,
+        )
+
+    def request(self, method, path, payload=None):
+        """
+        API에 요청을 보내고 응답을 그대로 반환합니다 (비스트리밍 중계용).
+
+        Args:
+            method (str): HTTP 메서드
+            path (str): base_url 뒤에 붙일 경로 (예: "/chat/completions")
+            payload (dict | RequestBody): 요청 본문 (None이면 본문 없음)
+
+        Returns:
+            httpx.Response: 응답
+        """
+        return self.http_client.request(
+            method, f"{self.base_url}{path}", **_body_kwargs(self._headers(), payload)
         )
 
     def generate_stream_response(
-        self, model, messages, temperature, max_tokens, use_mcp=False, mcp_servers=None
+        self, model, messages, temperature, max_tokens, use_mcp=False, mcp_servers=None,
+        hedge=False
     ):
         """
         스트리밍 방식으로 응답을 생성합니다.
 
         Args:
             model (str): 사용할 모델 이름
-            messages (list): 메시지 목록
+            messages (list): 메시지 목록 (EncodedMessages면 캐시된 직렬화 바이트로 본문 생성)
             temperature (float): 온도 값
             max_tokens (int): 최대 토큰 수
             use_mcp (bool): MCP 사용 여부
             mcp_servers (list): MCP 서버 목록
+            hedge (bool): 첫 토큰이 p95 임계값 안에 오지 않으면 동일 요청을 추가로 보낼지 여부
 
         Returns:
             generator: 응답 스트림 제너레이터
@@ -47,196 +190,223 @@ class PerplexityClient:
                 model, messages, temperature, max_tokens, mcp_servers
             )
         else:
-            return self._generate_with_openai(model, messages, temperature, max_tokens)
+            return self._generate_with_openai(
+                model, messages, temperature, max_tokens, hedge=hedge
+            )
 
-    def _generate_with_openai(self, model, messages, temperature, max_tokens):
+    def _generate_with_openai(self, model, messages, temperature, max_tokens, hedge=False):
         """OpenAI 라이브러리를 사용하여 응답 생성"""
-        stream = self.openai_client.chat.completions.create(
-            model=model,
-            messages=messages,
-            temperature=temperature,
-            max_tokens=max_tokens,
-            stream=True,
-        )
-        return stream
+        if isinstance(messages, EncodedMessages):
+            # 지난 메시지를 다시 직렬화하지 않도록 미리 직렬화된 본문을 httpx로 직접 전송
+            body = messages.body(
+                model=model, temperature=temperature, max_tokens=max_tokens, stream=True
+            )
+
+            def start_stream():
+                return SSEStream(
+                    f"{self.base_url}/chat/completions",
+                    headers=self._headers(),
+                    payload=body,
+                    client=self.http_client,
+                )
+        else:
+            def start_stream():
+                return self.openai_client.chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    temperature=temperature,
+                    max_tokens=max_tokens,
+                    stream=True,
+                )
+
+        if hedge:
+            return HedgedStream(start_stream, model)
+
+        # 헤징 임계값 학습을 위해 일반 요청도 첫 토큰 도착 시간을 기록
+        started_at = time.monotonic()
+        return TimedStream(start_stream(), model, started_at)
 
     def _generate_with_mcp(self, model, messages, temperature, max_tokens, mcp_servers):
         """MCP를 사용하여 직접 API 호출로 응답 생성"""
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json",
-        }
-
-        with httpx.Client() as client:
-            with client.stream(
-                "POST",
-                f"{self.base_url}/chat/completions",
-                headers=headers,
-                json={
-                    "model": model,
-                    "messages": messages,
-                    "temperature": temperature,
-                    "max_tokens": max_tokens,
-                    "stream": True,
-                    "mcp_servers": mcp_servers,
-                },
-            ) as response:
-                # Ensure the response is successful
-                response.raise_for_status()
-
-                for line in response.iter_lines():
-                    if line:
-                        # line is already a string from response.iter_lines()
-                        if line.startswith("data: "):
-                            line = line[6:]  # 'data: ' 접두사 제거
-                            if line != "[DONE]":
-                                try:
-                                    chunk_data = json.loads(line)
-                                    # citations 정보가 있으면 함께 전달
-                                    yield chunk_data
-                                except json.JSONDecodeError:
-                                    # Handle cases where a line might not be valid JSON
-                                    # or is an empty data field
-                                    pass
-
-    def use_async_api(self, messages, model, temperature, max_tokens):
+        return self.stream_chat({
+            "model": model,
+            "messages": messages,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+            "mcp_servers": mcp_servers,
+        })
+
+    def submit_async(self, messages, model, temperature, max_tokens):
         """
-        동기 API를 사용하여 응답을 생성하는 함수 (202 상태 코드 시 폴링 방식으로 결과 대기)
+        비스트리밍 요청을 보냅니다. 서버가 202로 응답하면 나중에 조회할 요청 ID를 반환합니다.
 
         Args:
-            messages (list): 메시지 목록
+            messages (list | EncodedMessages): 메시지 목록
             model (str): 사용할 모델 이름
             temperature (float): 온도 값
             max_tokens (int): 최대 토큰 수
 
         Returns:
-            dict: API 응답 JSON
+            tuple: (요청 ID 또는 None, 즉시 완료된 경우 API 응답 JSON 또는 None)
         """
-        import time
-
-        with httpx.Client() as client:
-            response = client.post(
-                f"{self.base_url}/chat/completions",
-                headers={
-                    "Authorization": f"Bearer {self.api_key}",
-                    "Content-Type": "application/json",
-                },
-                json={
-                    "model": model,
-                    "messages": messages,
-                    "temperature": temperature,
-                    "max_tokens": max_tokens,
-                    "stream": False,
-                },
-            )
+        fields = {"model": model, "temperature": temperature, "max_tokens": max_tokens, "stream": False}
+        if isinstance(messages, EncodedMessages):
+            payload = messages.body(**fields)
+        else:
+            payload = dict(fields, messages=messages)
+        response = self.request("POST", "/chat/completions", payload)
 
-            if response.status_code == 202:
-                request_id = response.json().get("id")
+        if response.status_code == 202:
+            return response.json().get("id"), None
 
-                # 요청 상태 확인
-                while True:
-                    status_response = client.get(
-                        f"{self.base_url}/chat/completions/{request_id}",
-                        headers={"Authorization": f"Bearer {self.api_key}"},
-                    )
+        response.raise_for_status()
+        return None, response.json()
+
+    def get_async_result(self, request_id):
+        """
+        비동기 요청의 결과를 조회합니다.
+
+        Args:
+            request_id (str): submit_async가 반환한 요청 ID
+
+        Returns:
+            dict | None: 완료된 경우 API 응답 JSON, 아직 진행 중이면 None
+
+        Raises:
+            httpx.HTTPStatusError: 요청이 실패했거나 만료된 경우 (4xx/5xx)
+        """
+        status_response = self.request("GET", f"/chat/completions/{request_id}")
+
+        if status_response.status_code == 200:
+            return status_response.json()
+        if status_response.status_code >= 400:
+            status_response.raise_for_status()
+        return None
+
+
+def _chunk_fields(chunk):
+    """
+    스트림 청크에서 응답 텍스트, 인용 정보, 사용량을 추출합니다.
+    OpenAI 라이브러리 객체와 직접 API 호출의 dict 청크를 모두 지원합니다.
+
+    Returns:
+        tuple: (응답 텍스트 또는 None, 인용 정보 또는 None, 사용량 또는 None)
+    """
+    # 직접 API 호출 응답인 경우
+    if isinstance(chunk, dict):
+        content = None
+        if chunk.get("choices"):
+            content = chunk["choices"][0].get("delta", {}).get("content")
+        return content, chunk.get("search_results"), chunk.get("usage")
 
-                    if status_response.status_code == 200:
-                        return status_response.json()
+    # OpenAI 라이브러리 응답인 경우
+    content = None
+    if (
+        hasattr(chunk, "choices")
+        and chunk.choices
+        and hasattr(chunk.choices[0], "delta")
+    ):
+        content = chunk.choices[0].delta.content
+    return (
+        content,
+        getattr(chunk, "search_results", None),
+        getattr(chunk, "usage", None),
+    )
 
-                    time.sleep(1)  # 1초 대기 후 다시 확인
 
-            return response.json()
+def _pump_stream(stream, events):
+    """별도 스레드에서 스트림을 읽어 이벤트 큐로 전달합니다."""
+    try:
+        for chunk in stream:
+            events.put(("chunk", chunk))
+        events.put(("done", None))
+    except Exception as e:
+        events.put(("error", e))
 
 
-def process_stream_response(stream, message_placeholder, cancel_flag_getter):
+def process_stream_response(
+    stream, message_placeholder, cancel_flag_getter, generation=None, on_delta=None
+):
     """
     스트림 응답을 처리하고 UI에 표시합니다.
+    스트림은 별도 스레드에서 읽고, 스크립트 스레드는 짧은 주기로 UI를 갱신하므로
+    다음 청크를 기다리는 중에도 재실행(취소 버튼 클릭 등)에 의해 즉시 중단될 수 있습니다.
+    정상 완료되지 않으면 업스트림 연결을 닫고 부분 응답과 사용량을 기록합니다.
 
     Args:
         stream: 응답 스트림
-        message_placeholder: 메시지를 표시할 placeholder
+        message_placeholder: 메시지를 표시할 placeholder (None이면 UI에 표시하지 않음)
         cancel_flag_getter: 취소 플래그를 가져오는 함수
+        generation (Generation): 외부에서 취소할 수 있도록 등록된 생성 핸들
+        on_delta (callable): 응답 텍스트 조각이 도착할 때마다 호출할 함수
 
     Returns:
         tuple: (전체 응답 텍스트, 메타데이터)
     """
     full_response = ""
     metadata = {"usage": None, "citations": []}
+    events = queue.Queue()
+    threading.Thread(target=_pump_stream, args=(stream, events), daemon=True).start()
 
-    # OpenAI 라이브러리 응답인 경우
-    if hasattr(stream, "__iter__"):
-        for chunk in stream:
-            # 취소 플래그 확인
-            if cancel_flag_getter():
-                break
+    def is_cancelled():
+        return cancel_flag_getter() or (
+            generation is not None and generation.cancelled.is_set()
+        )
 
-            if (
-                hasattr(chunk, "choices")
-                and chunk.choices
-                and hasattr(chunk.choices[0], "delta")
-            ):
-                if chunk.choices[0].delta.content:
-                    full_response += chunk.choices[0].delta.content
+    completed = False
+    try:
+        while not is_cancelled():
+            try:
+                kind, payload = events.get(timeout=CANCEL_POLL_INTERVAL)
+            except queue.Empty:
+                # 청크가 없어도 UI를 갱신하여 Streamlit이 재실행 요청을 처리할 수 있게 함
+                if message_placeholder is not None:
                     message_placeholder.write(full_response + "▌")
-                    # yield chunk.choices[0].delta.content
-
-            # citations 필드가 있는지 확인
-            if hasattr(chunk, "search_results"):
-                # metadata["citations"].extend(
-                #     [
-                #         {"title": citation["title"], "url": citation["url"]}
-                #         for citation in chunk.search_results
-                #         if citation["url"] not in [c["url"] for c in metadata["citations"]]
-                #     ]   # 중복 제거
-                # )
-                metadata["citations"] = chunk.search_results
-
-            if hasattr(chunk, "usage"):
-                metadata["usage"] = chunk.usage
-
-        # if hasattr(stream, "chunk") and stream.chunk:
-        #     # 메타데이터 추출
-        #     if hasattr(stream.chunk, "usage"):
-        #         metadata["usage"] = stream.chunk.usage
-
-        #     # 최종 응답에서 citations 확인
-        #     if hasattr(stream.chunk, "search_results"):
-        #         metadata["citations"] = stream.chunk.search_results
+                continue
 
-    # 직접 API 호출 응답인 경우
-    else:
-        # citations = []
-        for chunk in stream:
-            if cancel_flag_getter():
+            if kind == "done":
+                completed = True
                 break
-
-            if chunk.get("choices") and chunk["choices"][0].get("delta", {}).get(
-                "content"
-            ):
-                content = chunk["choices"][0]["delta"]["content"]
+            if kind == "error":
+                # 취소로 연결이 닫혀 발생한 오류는 무시
+                if is_cancelled():
+                    break
+                raise payload
+
+            content, search_results, usage = _chunk_fields(payload)
+            if content:
                 full_response += content
-                message_placeholder.write(full_response + "▌")
-                # yield chunk.choices[0].delta.content
-
-            # citations 필드 확인
-            # if chunk.get("search_results"):
-                # citations.extend(chunk["search_results"])
-                # citations = [
-                #         {"title": citation["title"], "url": citation["url"]}
-                #         for citation in chunk.search_results
-                #         if citation["url"] not in [c["url"] for c in metadata["citations"]]
-                #     ]  # 중복 제거
-            if "search_results" in chunk:
-                metadata["citations"] = chunk["search_results"]
-
-            # 메타데이터 추출
-            if "usage" in chunk:
-                metadata["usage"] = chunk["usage"]
-
-        # metadata["citations"] = citations
+                if on_delta is not None:
+                    on_delta(content)
+                if message_placeholder is not None:
+                    message_placeholder.write(full_response + "▌")
+            if search_results is not None:
+                metadata["citations"] = search_results
+            if usage is not None:
+                metadata["usage"] = usage
+    finally:
+        if not completed:
+            # 업스트림 연결을 즉시 닫아 토큰 소모 중단
+            close_stream(stream)
+            metadata["cancelled"] = True
+            if metadata["usage"] is None:
+                metadata["usage"] = {
+                    "prompt_tokens": "N/A",
+                    "completion_tokens": estimate_tokens(full_response),
+                    "total_tokens": "N/A",
+                }
+            metadata["usage_partial"] = True
+        if generation is not None:
+            generation.finish(full_response, metadata)
+
+    # 헤징 결과 기록
+    hedge_info = getattr(stream, "hedge_info", None)
+    if hedge_info:
+        metadata["hedge"] = hedge_info
 
     # 최종 응답 표시
-    message_placeholder.write(full_response)
+    if message_placeholder is not None:
+        message_placeholder.write(full_response)
 
     # 참조 링크 추출 (citations에서 추출하지 못한 경우를 위한 백업)
     if not metadata["citations"]:
@@ -254,6 +424,50 @@ def process_stream_response(stream, message_placeholder, cancel_flag_getter):
     return full_response, metadata
 
 
+def metadata_from_completion(result):
+    """
+    비스트리밍 응답 JSON에서 응답 텍스트와 메타데이터를 추출합니다.
+
+    Args:
+        result (dict): chat completions API 응답 JSON
+
+    Returns:
+        tuple: (응답 텍스트, 메타데이터)
+    """
+    choices = result.get("choices") or [{}]
+    full_response = (choices[0].get("message") or {}).get("content") or ""
+    metadata = {
+        "usage": result.get("usage"),
+        "citations": result.get("search_results") or [],
+    }
+    if not metadata["citations"]:
+        metadata["references"] = extract_references(full_response)
+    else:
+        metadata["references"] = [
+            set(
+                citation.get("url")
+                for citation in metadata["citations"]
+                if citation.get("url")
+            )
+        ]
+    return full_response, metadata
+
+
+def estimate_tokens(text):
+    """
+    텍스트의 토큰 수를 대략적으로 추정합니다 (UTF-8 4바이트당 약 1토큰).
+
+    Args:
+        text (str): 추정할 텍스트
+
+    Returns:
+        int: 추정 토큰 수
+    """
+    if not text:
+        return 0
+    return max(1, len(text.encode("utf-8")) // 4)
+
+
 def extract_references(text):
     """
     텍스트에서 URL 참조를 추출합니다.
@@ -274,13 +488,22 @@ def extract_references(text):
 
 def display_metadata(metadata):
     """
-    메타데이터를 Streamlit UI에 표시합니다 (토큰 사용량, 인용 정보, 참조 링크).
+    메타데이터를 Streamlit UI에 표시합니다 (자동 모델 선택 결과, 토큰 사용량, 인용 정보, 참조 링크).
 
     Args:
-        metadata (dict): 표시할 메타데이터 (usage, citations, references 포함)
+        metadata (dict): 표시할 메타데이터 (routing, usage, citations, references 포함)
     """
+    # 자동 모델 선택 결과 표시 (사용량 정보가 없어도 항상 표시)
+    routing = metadata.get("routing")
+    if routing:
+        from modules.model_router import describe_routing
+
+        st.caption(f"자동 모델 선택: {describe_routing(routing)}")
+
     # 토큰 사용량 표시
     if metadata.get("usage"):
+        from modules.usage_ledger import shared_usage_source
+
         usage = metadata["usage"]
         with st.expander("응답 메타데이터", expanded=False):
             st.write("**토큰 사용량:**")
@@ -294,6 +517,32 @@ def display_metadata(metadata):
                 f"- 총 토큰: {usage.total_tokens if hasattr(usage, 'total_tokens') else usage.get('total_tokens', 'N/A')}"
             )
 
+            if metadata.get("usage_partial"):
+                st.write("- 생성이 취소되어 부분 사용량입니다 (완성 토큰은 추정값일 수 있음)")
+            elif shared_usage_source(usage) is not None:
+                st.write("- 게이트웨이가 다른 요청의 응답을 재사용했습니다 (사용량은 원래 요청에만 기록)")
+
+            # 사전 추정 및 max_tokens 조정 결과 표시
+            preflight = metadata.get("preflight")
+            if preflight:
+                st.write(
+                    f"- 프롬프트 추정: {preflight['prompt_tokens_estimate']} 토큰, "
+                    f"max_tokens: {preflight['max_tokens']} (설정값 {preflight['requested']})"
+                )
+
+            # 헤징 결과 표시
+            hedge_info = metadata.get("hedge")
+            if hedge_info:
+                st.write("**요청 헤징:**")
+                st.write(f"- 첫 토큰 도착 시간: {hedge_info['ttft']:.2f}초")
+                if hedge_info["hedged"]:
+                    saved = hedge_info.get("saved")
+                    st.write(
+                        f"- 추가 요청 발생 (임계값 {hedge_info['threshold']:.2f}초), "
+                        f"승리: {hedge_info['winner']}, "
+                        + (f"절감 시간: {saved:.2f}초" if saved is not None else "절감 시간: 측정 중")
+                    )
+
     # 참조 링크 표시
     references = metadata.get("references", [])
     citations = metadata.get("citations", [])
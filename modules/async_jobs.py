@@ -0,0 +1,278 @@
+"""
+비동기 작업 추적 모듈
+sonar-deep-research 등 오래 걸리는 비동기 요청의 ID를 SQLite 작업 테이블에 기록하고,
+하나의 백그라운드 폴러가 모든 미완료 작업을 조회하여 결과를 저장합니다.
+프로세스가 재시작되어도 미완료 작업을 이어서 조회하므로 비용이 지불된 작업이 유실되지 않습니다.
+"""
+
+import os
+import json
+import hashlib
+import sqlite3
+import threading
+import datetime
+from contextlib import contextmanager
+
+import httpx
+
+from modules.usage_ledger import usage_ledger
+from modules.payload_builder import EncodedMessages
+
+# 작업 테이블 데이터베이스 경로
+ASYNC_JOBS_PATH = os.getenv("ASYNC_JOBS_PATH", "async_jobs.sqlite3")
+
+# 미완료 작업 조회 주기(초)
+POLL_INTERVAL = 5
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS async_jobs (
+    id TEXT PRIMARY KEY,
+    model TEXT NOT NULL,
+    prompt_hash TEXT NOT NULL,
+    session_id TEXT,
+    status TEXT NOT NULL,
+    result TEXT,
+    error TEXT,
+    delivered INTEGER NOT NULL DEFAULT 0,
+    metadata TEXT,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS async_jobs_status ON async_jobs (status);
+CREATE INDEX IF NOT EXISTS async_jobs_session ON async_jobs (session_id, delivered);
+CREATE INDEX IF NOT EXISTS async_jobs_prompt ON async_jobs (session_id, prompt_hash);
+"""
+
+_COLUMNS = (
+    "id", "model", "prompt_hash", "session_id", "status", "result", "error",
+    "delivered", "metadata", "created_at", "updated_at",
+)
+
+
+def prompt_hash(model, messages):
+    """
+    모델과 메시지 목록으로 프롬프트 해시를 계산합니다 (동일 요청 중복 제출 확인용).
+
+    Returns:
+        str: SHA-256 16진수 문자열
+    """
+    if isinstance(messages, EncodedMessages):
+        # 미리 직렬화된 메시지는 바이트를 그대로 해시
+        digest = hashlib.sha256(model.encode("utf-8") + b"\0")
+        digest.update(messages.digest_source())
+        return digest.hexdigest()
+    payload = json.dumps({"model": model, "messages": messages}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _now():
+    return datetime.datetime.now().isoformat(timespec="seconds")
+
+
+class AsyncJobStore:
+    """비동기 작업 상태를 보관하는 SQLite 작업 테이블"""
+
+    def __init__(self, path=ASYNC_JOBS_PATH):
+        """
+        Args:
+            path (str): SQLite 데이터베이스 파일 경로
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        with self._connect() as conn:
+            conn.executescript(_SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        """트랜잭션을 커밋하고 연결을 닫는 컨텍스트를 반환합니다."""
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _select(self, where, params):
+        with self._connect() as conn:
+            rows = conn.execute(
+                f"SELECT {', '.join(_COLUMNS)} FROM async_jobs WHERE {where} ORDER BY created_at",
+                params,
+            ).fetchall()
+        return [dict(zip(_COLUMNS, row)) for row in rows]
+
+    def add(
+        self, job_id, model, prompt_digest, session_id, status="pending", result=None, metadata=None
+    ):
+        """
+        작업을 기록합니다.
+
+        Args:
+            job_id (str): API가 반환한 요청 ID
+            model (str): 모델 이름
+            prompt_digest (str): 프롬프트 해시
+            session_id (str): 결과를 전달할 세션 ID
+            status (str): 작업 상태 (pending | completed | failed)
+            result (dict): 완료된 경우 API 응답 JSON
+            metadata (dict): 결과와 함께 대화에 전달할 메타데이터 (자동 모델 선택 결과 등)
+        """
+        now = _now()
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO async_jobs (id, model, prompt_hash, session_id, status,"
+                " result, delivered, metadata, created_at, updated_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, 0, ?, ?, ?)",
+                (
+                    job_id, model, prompt_digest, session_id, status,
+                    json.dumps(result, ensure_ascii=False) if result is not None else None,
+                    json.dumps(metadata, ensure_ascii=False) if metadata is not None else None,
+                    now, now,
+                ),
+            )
+
+    def update(self, job_id, status, result=None, error=None):
+        """작업 상태와 결과를 갱신합니다."""
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                "UPDATE async_jobs SET status = ?, result = ?, error = ?, updated_at = ? WHERE id = ?",
+                (
+                    status,
+                    json.dumps(result, ensure_ascii=False) if result is not None else None,
+                    error,
+                    _now(),
+                    job_id,
+                ),
+            )
+
+    def mark_delivered(self, job_id):
+        """결과가 세션에 전달되었음을 기록합니다."""
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                "UPDATE async_jobs SET delivered = 1, updated_at = ? WHERE id = ?",
+                (_now(), job_id),
+            )
+
+    def pending(self, session_id=None):
+        """미완료 작업 목록을 반환합니다 (session_id를 주면 해당 세션의 작업만)."""
+        if session_id is None:
+            return self._select("status = 'pending'", ())
+        return self._select("status = 'pending' AND session_id = ?", (session_id,))
+
+    def undelivered(self, session_id):
+        """세션에 아직 전달되지 않은 완료/실패 작업 목록을 반환합니다."""
+        return self._select(
+            "status != 'pending' AND delivered = 0 AND session_id = ?", (session_id,)
+        )
+
+    def find_pending(self, model, prompt_digest, session_id):
+        """
+        같은 세션에서 같은 프롬프트로 진행 중인 작업이 있으면 반환합니다.
+        결과는 작업을 제출한 세션에만 전달되므로 다른 세션의 작업은 재사용하지 않습니다.
+        """
+        jobs = self._select(
+            "status = 'pending' AND model = ? AND prompt_hash = ? AND session_id = ?",
+            (model, prompt_digest, session_id),
+        )
+        return jobs[0] if jobs else None
+
+
+class AsyncJobPoller:
+    """모든 미완료 비동기 작업을 하나의 백그라운드 스레드에서 조회하는 폴러"""
+
+    def __init__(self, client, store, interval=POLL_INTERVAL):
+        """
+        Args:
+            client (PerplexityClient): 결과 조회에 사용할 API 클라이언트
+            store (AsyncJobStore): 작업 테이블
+            interval (float): 조회 주기(초)
+        """
+        self.client = client
+        self.store = store
+        self.interval = interval
+        self._wakeup = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="async-job-poller", daemon=True)
+        self._thread.start()
+
+    def wake(self):
+        """새 작업이 추가되었을 때 다음 조회를 앞당깁니다."""
+        self._wakeup.set()
+
+    def poll_once(self):
+        """미완료 작업을 한 번씩 조회하여 상태를 갱신합니다."""
+        for job in self.store.pending():
+            try:
+                result = self.client.get_async_result(job["id"])
+            except httpx.HTTPStatusError as e:
+                # 429와 5xx는 다음 주기에 다시 시도, 그 외 오류는 실패로 기록
+                if e.response.status_code == 429 or e.response.status_code >= 500:
+                    continue
+                self.store.update(job["id"], "failed", error=str(e))
+                continue
+            except httpx.HTTPError:
+                continue
+
+            if result is not None:
+                self.store.update(job["id"], "completed", result=result)
+                usage_ledger.record(job["session_id"], job["model"], result.get("usage"))
+
+    def _run(self):
+        # 시작 직후 한 번 조회하여 재시작 전에 제출된 작업을 이어서 처리
+        while True:
+            try:
+                self.poll_once()
+            except Exception:
+                pass
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+
+
+_poller = None
+_poller_lock = threading.Lock()
+
+
+def ensure_poller(client, store):
+    """
+    프로세스당 하나의 폴러를 시작합니다 (이미 실행 중이면 기존 폴러를 반환).
+
+    Returns:
+        AsyncJobPoller: 실행 중인 폴러
+    """
+    global _poller
+    with _poller_lock:
+        if _poller is None:
+            _poller = AsyncJobPoller(client, store)
+        return _poller
+
+
+def submit_async_job(
+    client, store, model, messages, temperature, max_tokens, session_id, metadata=None
+):
+    """
+    비동기 작업을 제출하고 작업 테이블에 기록합니다.
+    같은 세션에서 같은 프롬프트로 진행 중인 작업이 있으면 다시 제출하지 않고 기존 작업을 사용합니다.
+    metadata(자동 모델 선택 결과 등)는 작업과 함께 저장되어 결과를 전달할 때 응답 메타데이터에 합쳐집니다.
+
+    Returns:
+        str: 작업 ID
+    """
+    digest = prompt_hash(model, messages)
+    existing = store.find_pending(model, digest, session_id)
+    if existing is not None:
+        return existing["id"]
+
+    request_id, result = client.submit_async(messages, model, temperature, max_tokens)
+    if request_id is None:
+        # 서버가 즉시 응답한 경우에도 같은 경로로 세션에 전달
+        request_id = result.get("id") or digest
+        store.add(
+            request_id, model, digest, session_id, status="completed", result=result,
+            metadata=metadata,
+        )
+        usage_ledger.record(session_id, model, result.get("usage"))
+    else:
+        store.add(request_id, model, digest, session_id, metadata=metadata)
+        ensure_poller(client, store).wake()
+    return request_id
+
+
+# 프로세스 전체에서 공유하는 작업 테이블
+async_job_store = AsyncJobStore()
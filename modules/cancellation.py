@@ -0,0 +1,86 @@
+"""
+응답 생성 취소 모듈
+진행 중인 스트림을 프로세스 단위 레지스트리에 등록해 두고,
+스크립트 실행과 무관하게(out of band) 업스트림 연결을 즉시 닫을 수 있도록 합니다.
+"""
+
+import threading
+import uuid
+
+from modules.hedging import close_stream
+
+
+class Generation:
+    """진행 중인 응답 생성 하나를 나타내는 핸들"""
+
+    def __init__(self, stream):
+        """
+        Args:
+            stream: 응답 스트림 (OpenAI Stream, httpx 기반 스트림 등)
+        """
+        self.id = uuid.uuid4().hex
+        self.stream = stream
+        self.cancelled = threading.Event()
+        self.done = threading.Event()
+        # 완료 또는 중단 시점의 (응답 텍스트, 메타데이터)
+        self.result = None
+
+    def cancel(self):
+        """생성을 취소하고 업스트림 연결을 즉시 닫습니다."""
+        self.cancelled.set()
+        close_stream(self.stream)
+
+    def finish(self, full_response, metadata):
+        """생성 결과(부분 응답 포함)를 기록합니다."""
+        self.result = (full_response, metadata)
+        self.done.set()
+
+
+class GenerationRegistry:
+    """프로세스 전체에서 진행 중인 생성 핸들을 관리하는 클래스"""
+
+    def __init__(self):
+        self._generations = {}
+        self._lock = threading.Lock()
+
+    def start(self, stream):
+        """
+        스트림을 등록하고 생성 핸들을 반환합니다.
+
+        Args:
+            stream: 응답 스트림
+
+        Returns:
+            Generation: 생성 핸들
+        """
+        generation = Generation(stream)
+        with self._lock:
+            self._generations[generation.id] = generation
+        return generation
+
+    def get(self, generation_id):
+        """생성 핸들을 반환합니다 (없으면 None)."""
+        with self._lock:
+            return self._generations.get(generation_id)
+
+    def cancel(self, generation_id):
+        """
+        생성을 취소합니다.
+
+        Returns:
+            bool: 취소할 생성이 있었는지 여부
+        """
+        generation = self.get(generation_id)
+        if generation is None:
+            return False
+        generation.cancel()
+        return True
+
+    def pop(self, generation_id):
+        """생성 핸들을 레지스트리에서 제거하고 반환합니다 (없으면 None)."""
+        with self._lock:
+            return self._generations.pop(generation_id, None)
+
+
+# 프로세스 전체에서 공유하는 생성 레지스트리
+generation_registry = GenerationRegistry()
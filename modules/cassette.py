@@ -0,0 +1,292 @@
+"""
+카세트 녹화/재생 모듈
+Perplexity API의 원본 SSE 트래픽(청크 크기, 도착 시각, search_results/usage 프레임 위치)을
+압축된 카세트 파일로 녹화하고, 네트워크 없이 원래 또는 배속 타이밍으로 재생하는 httpx 트랜스포트를 제공합니다.
+
+사용 예:
+    # 녹화: PERPLEXITY_RECORD_DIR=cassettes streamlit run perplexity_chat_app.py
+    # 재생: PERPLEXITY_REPLAY_CASSETTE=cassettes/xxx.cassette.json.gz streamlit run perplexity_chat_app.py
+    # 프로파일링: python -m modules.cassette cassettes/xxx.cassette.json.gz --speed 0
+"""
+
+import os
+import json
+import gzip
+import time
+import itertools
+import datetime
+import threading
+
+import httpx
+
+CASSETTE_VERSION = 1
+CASSETTE_SUFFIX = ".cassette.json.gz"
+
+# 녹화 시 요청 본문에서 남길 필드 (메시지 내용 등은 저장하지 않음)
+_RECORDED_REQUEST_FIELDS = ("model", "temperature", "max_tokens", "stream")
+
+
+def _request_summary(request):
+    """녹화할 요청 정보를 추출합니다. 인증 헤더와 메시지 내용은 기록하지 않습니다."""
+    summary = {"method": request.method, "path": request.url.path}
+    try:
+        body = json.loads(request.read() or b"{}")
+    except ValueError:
+        return summary
+    summary.update({k: body[k] for k in _RECORDED_REQUEST_FIELDS if k in body})
+    if isinstance(body.get("messages"), list):
+        summary["messages"] = len(body["messages"])
+    return summary
+
+
+def load_cassette(path):
+    """
+    카세트 파일을 읽습니다.
+
+    Args:
+        path (str): 카세트 파일 경로
+
+    Returns:
+        dict: 카세트 데이터 (request, status_code, headers, events)
+    """
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        cassette = json.load(f)
+    if cassette.get("version") != CASSETTE_VERSION:
+        raise ValueError(f"지원하지 않는 카세트 버전입니다: {cassette.get('version')}")
+    return cassette
+
+
+class _RecordingStream(httpx.SyncByteStream):
+    """응답 바이트를 그대로 전달하면서 도착 시각과 함께 기록하는 스트림"""
+
+    def __init__(self, inner, cassette, started_at, path):
+        self.inner = inner
+        self.cassette = cassette
+        self.started_at = started_at
+        self.path = path
+        self._saved = False
+
+    def __iter__(self):
+        for chunk in self.inner:
+            # latin-1은 바이트와 문자가 1:1로 대응하므로 청크 경계가 UTF-8 문자 중간이어도 손실이 없음
+            self.cassette["events"].append(
+                [round(time.monotonic() - self.started_at, 4), chunk.decode("latin-1")]
+            )
+            yield chunk
+
+    def close(self):
+        try:
+            self.inner.close()
+        finally:
+            self._save()
+
+    def _save(self):
+        if self._saved:
+            return
+        self._saved = True
+        with gzip.open(self.path, "wt", encoding="utf-8") as f:
+            json.dump(self.cassette, f, ensure_ascii=False, separators=(",", ":"))
+
+
+class RecordingTransport(httpx.BaseTransport):
+    """실제 네트워크로 요청을 보내고 응답을 카세트 파일로 녹화하는 트랜스포트"""
+
+    def __init__(self, directory, inner=None):
+        """
+        Args:
+            directory (str): 카세트 파일을 저장할 디렉터리
+            inner (httpx.BaseTransport): 실제 요청을 보낼 트랜스포트 (기본값 httpx.HTTPTransport)
+        """
+        self.directory = directory
+        self.inner = inner or httpx.HTTPTransport()
+        self._counter = itertools.count(1)
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _next_path(self, model):
+        with self._lock:
+            index = next(self._counter)
+        timestamp = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+        return os.path.join(self.directory, f"{timestamp}_{index:04d}_{model}{CASSETTE_SUFFIX}")
+
+    def handle_request(self, request):
+        started_at = time.monotonic()
+        summary = _request_summary(request)
+        response = self.inner.handle_request(request)
+        cassette = {
+            "version": CASSETTE_VERSION,
+            "recorded_at": datetime.datetime.now().isoformat(timespec="seconds"),
+            "request": summary,
+            "status_code": response.status_code,
+            "headers": {
+                k: v for k, v in response.headers.items()
+                if k.lower() in ("content-type", "content-encoding")
+            },
+            "header_delay": round(time.monotonic() - started_at, 4),
+            "events": [],
+        }
+        return httpx.Response(
+            status_code=response.status_code,
+            headers=response.headers,
+            stream=_RecordingStream(
+                response.stream,
+                cassette,
+                started_at,
+                self._next_path(summary.get("model", "unknown")),
+            ),
+            extensions=response.extensions,
+            request=request,
+        )
+
+    def close(self):
+        # 여러 httpx.Client가 공유하므로 개별 클라이언트 종료 시에는 연결 풀을 닫지 않음
+        pass
+
+
+class _ReplayStream(httpx.SyncByteStream):
+    """카세트에 기록된 청크를 원래(또는 배속) 타이밍으로 내보내는 스트림"""
+
+    def __init__(self, events, speed, started_at):
+        self.events = events
+        self.speed = speed
+        self.started_at = started_at
+        self.closed = False
+
+    def __iter__(self):
+        for offset, text in self.events:
+            if self.closed:
+                break
+            if self.speed:
+                delay = offset / self.speed - (time.monotonic() - self.started_at)
+                if delay > 0:
+                    time.sleep(delay)
+            yield text.encode("latin-1")
+
+    def close(self):
+        self.closed = True
+
+
+class ReplayTransport(httpx.BaseTransport):
+    """네트워크 없이 카세트 파일의 응답을 재생하는 트랜스포트"""
+
+    def __init__(self, paths, speed=1.0):
+        """
+        Args:
+            paths (str | list): 카세트 파일 경로 (여러 개면 요청마다 순서대로 돌아가며 재생)
+            speed (float): 재생 배속 (1.0은 원래 속도, 0이면 지연 없이 즉시 재생)
+        """
+        if isinstance(paths, str):
+            paths = [paths]
+        self.cassettes = [load_cassette(path) for path in paths]
+        self.speed = speed
+        self._cycle = itertools.cycle(self.cassettes)
+        self._lock = threading.Lock()
+
+    def handle_request(self, request):
+        with self._lock:
+            cassette = next(self._cycle)
+        started_at = time.monotonic()
+        if self.speed:
+            time.sleep(cassette.get("header_delay", 0) / self.speed)
+        return httpx.Response(
+            status_code=cassette["status_code"],
+            headers=cassette["headers"],
+            stream=_ReplayStream(cassette["events"], self.speed, started_at),
+            request=request,
+        )
+
+
+def transport_from_env():
+    """
+    환경 변수에 따라 녹화 또는 재생 트랜스포트를 생성합니다.
+
+    - PERPLEXITY_REPLAY_CASSETTE: 재생할 카세트 파일 경로 (쉼표로 여러 개 지정 가능)
+    - PERPLEXITY_REPLAY_SPEED: 재생 배속 (기본값 1.0)
+    - PERPLEXITY_RECORD_DIR: 녹화한 카세트를 저장할 디렉터리
+
+    Returns:
+        httpx.BaseTransport | None: 설정이 없으면 None
+    """
+    replay = os.getenv("PERPLEXITY_REPLAY_CASSETTE")
+    if replay:
+        return ReplayTransport(
+            [path.strip() for path in replay.split(",") if path.strip()],
+            speed=float(os.getenv("PERPLEXITY_REPLAY_SPEED", "1.0")),
+        )
+    record_dir = os.getenv("PERPLEXITY_RECORD_DIR")
+    if record_dir:
+        return RecordingTransport(record_dir)
+    return None
+
+
+class _NullPlaceholder:
+    """프로파일링용으로 화면 갱신 횟수와 글자 수만 집계하는 placeholder"""
+
+    def __init__(self):
+        self.writes = 0
+        self.chars = 0
+
+    def write(self, text):
+        self.writes += 1
+        self.chars += len(text)
+
+
+def profile_cassette(path, speed=0.0, use_mcp=False):
+    """
+    카세트를 PerplexityClient와 process_stream_response로 재생하여 처리 시간을 측정합니다.
+
+    Args:
+        path (str): 카세트 파일 경로
+        speed (float): 재생 배속 (0이면 지연 없이 재생하여 순수 처리 비용 측정)
+        use_mcp (bool): httpx 직접 호출 경로(_generate_with_mcp)로 재생할지 여부
+
+    Returns:
+        dict: 첫 토큰 시간, 전체 시간, 응답 길이, 화면 갱신 횟수
+    """
+    from modules.api_client import PerplexityClient, process_stream_response
+
+    cassette = load_cassette(path)
+    request = cassette["request"]
+    client = PerplexityClient("replay", transport=ReplayTransport(path, speed=speed))
+
+    started_at = time.monotonic()
+    first_token_at = []
+    stream = client.generate_stream_response(
+        model=request.get("model", "sonar"),
+        messages=[{"role": "user", "content": "replay"}],
+        temperature=request.get("temperature", 0.7),
+        max_tokens=request.get("max_tokens", 1000),
+        use_mcp=use_mcp,
+        mcp_servers=[{"url": "replay"}] if use_mcp else None,
+    )
+    placeholder = _NullPlaceholder()
+    full_response, metadata = process_stream_response(
+        stream,
+        placeholder,
+        lambda: False,
+        on_delta=lambda _: first_token_at or first_token_at.append(time.monotonic()),
+    )
+    finished_at = time.monotonic()
+    return {
+        "ttft": first_token_at[0] - started_at if first_token_at else None,
+        "total": finished_at - started_at,
+        "chars": len(full_response),
+        "writes": placeholder.writes,
+        "rendered_chars": placeholder.chars,
+        "events": len(cassette["events"]),
+        "citations": len(metadata.get("citations") or []),
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="카세트를 재생하여 스트림 처리 성능을 측정합니다.")
+    parser.add_argument("cassettes", nargs="+", help="카세트 파일 경로")
+    parser.add_argument("--speed", type=float, default=0.0, help="재생 배속 (0이면 지연 없음)")
+    parser.add_argument("--mcp", action="store_true", help="httpx 직접 호출 경로로 재생")
+    args = parser.parse_args()
+
+    for cassette_path in args.cassettes:
+        result = profile_cassette(cassette_path, speed=args.speed, use_mcp=args.mcp)
+        print(f"{os.path.basename(cassette_path)}: {json.dumps(result, ensure_ascii=False)}")
@@ -9,6 +9,7 @@ import base64
 import datetime
 import pandas as pd
 import streamlit as st
+from modules.json_summarizer import summarize_json_stream, encode_summary
 
 def process_file(file):
     """
@@ -21,6 +22,21 @@ def process_file(file):
         tuple: (성공 여부(bool), 처리된 파일 정보(dict) 또는 오류 메시지(str))
     """
     file_type = file.type
+
+    # JSON 파일은 전체를 읽지 않고 스트리밍으로 구조 요약만 생성
+    if file_type in ['application/json']:
+        try:
+            file.seek(0)
+            summary, size = summarize_json_stream(file)
+            return True, {
+                "type": "json",
+                # 첨부 메시지의 길이 제한 안에 들어가도록 샘플/경로를 줄여 직렬화
+                "content": encode_summary(summary),
+                "summary": f"JSON 파일 구조 요약 ({size} 바이트, 경로 {len(summary['paths'])}개)"
+            }
+        except Exception as e:
+            return False, f"JSON 파일 처리 오류: ({str(e)})"
+
     file_content = file.read()
 
     # 파일 유형에 따른 처리
@@ -70,23 +86,6 @@ def process_file(file):
     #             "summary": f"Excel 파일 처리 오류: {str(e)}"
     #         }
 
-    elif file_type in ['application/json']:
-        # JSON 파일
-        try:
-            json_data = json.loads(file_content)
-            return True, {
-                "type": "json",
-                "content": json.dumps(json_data, ensure_ascii=False),
-                "summary": "JSON 파일"
-            }
-        except Exception as e:
-            return False, f"JSON 파일 처리 오류: ({str(e)})"
-            # return {
-            #     "type": "binary",
-            #     "content": base64.b64encode(file_content).decode('utf-8'),
-            #     "summary": f"JSON 파일 처리 오류: {str(e)}"
-            # }
-
     return False, "지원되지 않는 파일 형식입니다."
     # 기타 파일
     # return {
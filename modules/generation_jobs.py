@@ -0,0 +1,189 @@
+"""
+백그라운드 응답 생성 작업 모듈
+프로세스 단위 워커 풀이 응답 스트림을 소유하고 작업 ID별로 델타를 버퍼링합니다.
+UI는 작업에 연결(attach)하여 놓친 델타를 다시 재생할 수 있으므로,
+재실행이나 웹소켓 재연결 후에도 긴 응답이 유지됩니다.
+"""
+
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from modules.api_client import process_stream_response
+from modules.cancellation import generation_registry
+
+# 동시에 실행할 수 있는 생성 작업 수
+MAX_WORKERS = 8
+
+# 완료된 작업을 재연결용으로 보관하는 시간(초)
+JOB_RETENTION_SECONDS = 600
+
+
+class GenerationJob:
+    """백그라운드에서 실행되는 응답 생성 작업 하나"""
+
+    def __init__(self, conversation=None, session_id=None, metadata_history=None):
+        """
+        Args:
+            conversation (list): 작업 시작 시점의 대화 기록 (새 세션에서 재연결할 때 복원용)
+            session_id (str): 작업을 시작한 세션 ID (세션 저장소 참조 복원용)
+            metadata_history (list): 작업 시작 시점의 응답별 메타데이터 (대화 기록과 함께 복원)
+        """
+        self.id = uuid.uuid4().hex
+        self.conversation = conversation or []
+        self.metadata_history = metadata_history or []
+        self.session_id = session_id
+        self.status = "pending"  # pending | running | done | cancelled | error
+        self.deltas = []
+        self.metadata = None
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self.cancelled = threading.Event()
+        self.generation_id = None
+        self._cond = threading.Condition()
+
+    @property
+    def finished(self):
+        return self.status in ("done", "cancelled", "error")
+
+    def append(self, delta):
+        """응답 델타를 버퍼에 추가하고 대기 중인 구독자를 깨웁니다."""
+        with self._cond:
+            self.deltas.append(delta)
+            self._cond.notify_all()
+
+    def finish(self, status, metadata=None, error=None):
+        """작업을 종료 상태로 전환합니다."""
+        with self._cond:
+            self.status = status
+            self.metadata = metadata
+            self.error = error
+            self.finished_at = time.time()
+            self._cond.notify_all()
+
+    def wait_deltas(self, offset, timeout):
+        """
+        offset 이후의 델타를 기다렸다가 반환합니다.
+
+        Args:
+            offset (int): 이미 받은 델타 수
+            timeout (float): 새 델타가 없을 때 최대 대기 시간(초)
+
+        Returns:
+            tuple: (새 델타 목록, 작업 종료 여부)
+        """
+        with self._cond:
+            if len(self.deltas) <= offset and not self.finished:
+                self._cond.wait(timeout)
+            return self.deltas[offset:], self.finished
+
+    def text(self):
+        """지금까지 버퍼링된 전체 응답 텍스트를 반환합니다."""
+        with self._cond:
+            return "".join(self.deltas)
+
+
+class GenerationJobManager:
+    """응답 생성 작업을 워커 풀에서 실행하고 작업 ID로 조회할 수 있게 하는 클래스"""
+
+    def __init__(self, max_workers=MAX_WORKERS, retention=JOB_RETENTION_SECONDS):
+        self.retention = retention
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="generation"
+        )
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(
+        self, start_stream, conversation=None, session_id=None, on_complete=None,
+        metadata_history=None
+    ):
+        """
+        생성 작업을 제출합니다.
+
+        Args:
+            start_stream (callable): 워커 스레드에서 호출되어 응답 스트림을 생성하는 함수
+            conversation (list): 작업 시작 시점의 대화 기록
+            session_id (str): 작업을 시작한 세션 ID
+            on_complete (callable): 응답이 끝나거나 취소되었을 때 메타데이터를 인자로
+                워커 스레드에서 호출할 함수 (사용량 기록 등)
+            metadata_history (list): 작업 시작 시점의 응답별 메타데이터
+
+        Returns:
+            GenerationJob: 제출된 작업
+        """
+        self._evict_expired()
+        job = GenerationJob(conversation, session_id, metadata_history)
+        with self._lock:
+            self._jobs[job.id] = job
+        self._executor.submit(self._run, job, start_stream, on_complete)
+        return job
+
+    def get(self, job_id):
+        """작업을 반환합니다 (없거나 만료되었으면 None)."""
+        if not job_id:
+            return None
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id):
+        """
+        작업을 취소하고 업스트림 연결을 닫습니다.
+
+        Returns:
+            bool: 취소할 작업이 있었는지 여부
+        """
+        job = self.get(job_id)
+        if job is None:
+            return False
+        job.cancelled.set()
+        generation_registry.cancel(job.generation_id)
+        return True
+
+    def _run(self, job, start_stream, on_complete=None):
+        if job.cancelled.is_set():
+            job.finish("cancelled", {"usage": None, "citations": [], "cancelled": True})
+            return
+
+        job.status = "running"
+        generation = None
+        try:
+            stream = start_stream()
+            generation = generation_registry.start(stream)
+            job.generation_id = generation.id
+            if job.cancelled.is_set():
+                generation.cancel()
+
+            _, metadata = process_stream_response(
+                stream,
+                None,
+                job.cancelled.is_set,
+                generation=generation,
+                on_delta=job.append,
+            )
+            if on_complete is not None:
+                on_complete(metadata)
+            job.finish("cancelled" if metadata.get("cancelled") else "done", metadata)
+        except Exception as e:
+            job.finish("error", error=str(e))
+        finally:
+            if generation is not None:
+                generation_registry.pop(generation.id)
+
+    def _evict_expired(self):
+        """보관 기간이 지난 완료 작업을 제거합니다."""
+        now = time.time()
+        with self._lock:
+            expired = [
+                job_id
+                for job_id, job in self._jobs.items()
+                if job.finished and now - job.finished_at > self.retention
+            ]
+            for job_id in expired:
+                del self._jobs[job_id]
+
+
+# 프로세스 전체에서 공유하는 생성 작업 관리자
+job_manager = GenerationJobManager()
@@ -0,0 +1,318 @@
+"""
+요청 헤징(hedging) 모듈
+첫 토큰이 늦게 도착하는 스트림에 대해 동일한 요청을 한 번 더 보내고,
+먼저 내용을 전달하기 시작한 스트림만 사용하며 나머지 연결은 닫습니다.
+헤지 요청이 이기면 원래 요청은 첫 토큰이 올 때까지만 지켜본 뒤 닫아,
+원래 요청의 첫 토큰 도착 시간(느린 꼬리 포함)과 실제 절감 시간을 기록합니다.
+"""
+
+import queue
+import threading
+import time
+
+from modules.latency_stats import ttft_tracker
+
+# 헤징 임계값을 학습하기 위해 필요한 최소 표본 수 (이보다 적으면 헤징하지 않음)
+MIN_SAMPLES = 10
+
+# 헤지 요청이 이긴 뒤 원래 요청의 첫 토큰을 기다리는 최대 시간 (임계값의 배수, 요청 시작 기준)
+HEDGE_OBSERVE_FACTOR = 3
+
+
+def chunk_has_content(chunk):
+    """
+    스트림 청크에 응답 텍스트가 포함되어 있는지 확인합니다.
+    OpenAI 라이브러리 객체와 직접 API 호출의 dict 청크를 모두 지원합니다.
+    """
+    if isinstance(chunk, dict):
+        choices = chunk.get("choices")
+        return bool(choices and choices[0].get("delta", {}).get("content"))
+    choices = getattr(chunk, "choices", None)
+    return bool(
+        choices
+        and hasattr(choices[0], "delta")
+        and choices[0].delta.content
+    )
+
+
+def close_stream(stream):
+    """
+    응답 스트림의 업스트림 연결을 닫습니다.
+    OpenAI Stream, httpx 응답, 제너레이터를 모두 지원하며 오류는 무시합니다.
+    """
+    if stream is None:
+        return
+    for target in (stream, getattr(stream, "response", None)):
+        close = getattr(target, "close", None)
+        if close is not None:
+            try:
+                close()
+            except Exception:
+                pass
+
+
+class HedgeStats:
+    """헤징 발생률과 절감된 지연 시간을 집계하는 클래스"""
+
+    def __init__(self):
+        self.requests = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.saved_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, hedged, hedge_won, saved_seconds):
+        with self._lock:
+            self.requests += 1
+            if hedged:
+                self.hedged += 1
+            if hedge_won:
+                self.hedge_wins += 1
+                self.saved_seconds += saved_seconds
+
+    def summary(self):
+        """
+        집계 결과를 반환합니다.
+
+        Returns:
+            dict: 요청 수, 헤징 수, 헤징률, 헤징 승리 수, 추정 절감 시간(초)
+        """
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "hedged": self.hedged,
+                "hedge_rate": self.hedged / self.requests if self.requests else 0.0,
+                "hedge_wins": self.hedge_wins,
+                "saved_seconds": self.saved_seconds,
+            }
+
+
+# 프로세스 전체에서 공유하는 헤징 통계
+hedge_stats = HedgeStats()
+
+
+def hedge_threshold(model, tracker=ttft_tracker):
+    """
+    모델의 최근 p95 첫 토큰 도착 시간을 헤징 임계값으로 반환합니다.
+
+    Returns:
+        float | None: 임계값(초). 표본이 부족하면 None
+    """
+    if tracker.count(model) < MIN_SAMPLES:
+        return None
+    return tracker.p95(model)
+
+
+class _Racer(threading.Thread):
+    """요청 하나를 보내고 첫 내용 청크가 도착할 때까지 읽는 스레드"""
+
+    def __init__(self, index, start_stream, events):
+        super().__init__(daemon=True)
+        self.index = index
+        self.start_stream = start_stream
+        self.events = events
+        self.started_at = time.monotonic()
+        self.stream = None
+        self.iterator = None
+        self.prefix = []
+        self.exhausted = False
+        self.cancelled = False
+        # 첫 내용 청크(또는 스트림 끝) 도착 시각과 취소 외의 오류
+        self.first_at = None
+        self.error = None
+        self._lock = threading.Lock()
+
+    def run(self):
+        try:
+            stream = self.start_stream()
+            with self._lock:
+                self.stream = stream
+                if self.cancelled:
+                    close_stream(stream)
+                    return
+            self.iterator = iter(stream)
+            for chunk in self.iterator:
+                self.prefix.append(chunk)
+                if chunk_has_content(chunk):
+                    break
+            else:
+                self.exhausted = True
+            self.first_at = time.monotonic()
+            self.events.put(("first", self.index, self.first_at))
+        except Exception as e:
+            if not self.cancelled:
+                self.error = e
+                self.events.put(("error", self.index, e))
+
+    def cancel(self):
+        """진행 중인 요청을 취소하고 연결을 닫습니다."""
+        with self._lock:
+            self.cancelled = True
+            stream = self.stream
+        close_stream(stream)
+
+
+class HedgedStream:
+    """
+    헤징을 적용한 응답 스트림.
+    임계값 안에 첫 내용 청크가 도착하지 않으면 동일한 요청을 한 번 더 보내고,
+    먼저 내용을 전달한 스트림의 청크를 그대로 전달합니다.
+    헤징 결과는 반복이 시작된 뒤 `hedge_info` 속성으로 확인할 수 있습니다.
+    """
+
+    def __init__(self, start_stream, model, tracker=ttft_tracker, stats=hedge_stats):
+        """
+        Args:
+            start_stream (callable): 호출할 때마다 새 응답 스트림을 생성하는 함수
+            model (str): 모델 이름 (임계값 학습 및 통계 기록용)
+            tracker (LatencyTracker): 첫 토큰 도착 시간 통계
+            stats (HedgeStats): 헤징 통계
+        """
+        self.start_stream = start_stream
+        self.model = model
+        self.tracker = tracker
+        self.stats = stats
+        self.hedge_info = None
+        self._winner = None
+        self._racers = []
+        # 경쟁 중인 요청의 이벤트 큐 (close()가 경쟁 대기를 깨우는 데에도 사용)
+        self._events = queue.Queue()
+        self._closed = False
+
+    def _race(self):
+        """경쟁을 진행하고 승리한 스레드를 반환합니다 (첫 토큰 전에 닫히면 None)."""
+        threshold = hedge_threshold(self.model, self.tracker)
+        events = self._events
+        if self._closed:
+            self.stats.record(False, False, 0.0)
+            return None
+        primary = _Racer(0, self.start_stream, events)
+        self._racers = [primary]
+        primary.start()
+
+        event = None
+        if threshold is not None:
+            try:
+                event = events.get(timeout=threshold)
+            except queue.Empty:
+                hedge = _Racer(1, self.start_stream, events)
+                self._racers.append(hedge)
+                hedge.start()
+
+        errors = []
+        while True:
+            if event is None:
+                event = events.get()
+            kind, index, payload = event
+            event = None
+            if kind == "closed":
+                # 첫 토큰 전에 취소됨: 모든 요청을 닫고 요청 수만 기록 (첫 토큰 도착 시간은 알 수 없음)
+                for racer in self._racers:
+                    racer.cancel()
+                self.stats.record(len(self._racers) > 1, False, 0.0)
+                return None
+            if kind == "first":
+                winner = self._racers[index]
+                first_at = payload
+                break
+            errors.append(payload)
+            if len(errors) == len(self._racers):
+                raise errors[0]
+
+        hedged = len(self._racers) > 1
+        hedge_won = winner.index == 1
+        elapsed = first_at - primary.started_at
+        self.hedge_info = {
+            "hedged": hedged,
+            "winner": "hedge" if hedge_won else "primary",
+            "threshold": threshold,
+            "ttft": elapsed,
+            # 헤지 요청이 이긴 경우 원래 요청의 첫 토큰 도착 시간을 확인한 뒤 채워짐
+            "primary_ttft": None if hedge_won else elapsed,
+            "saved": None if hedge_won else 0.0,
+        }
+
+        for racer in self._racers:
+            if racer is not winner and racer is not primary:
+                racer.cancel()
+
+        if hedge_won:
+            # 원래 요청을 바로 닫으면 느린 꼬리가 표본에서 빠져 임계값이 점점 낮아지므로,
+            # 첫 토큰이 올 때까지(최대 임계값의 HEDGE_OBSERVE_FACTOR배) 지켜본 뒤 닫음
+            threading.Thread(
+                target=self._settle_primary,
+                args=(primary, first_at, threshold * HEDGE_OBSERVE_FACTOR),
+                daemon=True,
+            ).start()
+        else:
+            self.tracker.record(self.model, elapsed)
+            self.stats.record(hedged, False, 0.0)
+        return winner
+
+    def _settle_primary(self, primary, hedge_first_at, limit):
+        """
+        헤지 요청에 진 원래 요청의 첫 토큰을 기다린 뒤 연결을 닫고 TTFT와 절감 시간을 기록합니다.
+        제한 시간 안에(또는 취소되기 전에) 첫 토큰이 오지 않으면 닫은 시점까지의 시간을 하한값(검열된 표본)으로 기록합니다.
+
+        Args:
+            primary (_Racer): 원래 요청
+            hedge_first_at (float): 헤지 요청의 첫 토큰 도착 시각
+            limit (float): 원래 요청 시작부터 기다릴 최대 시간(초)
+        """
+        primary.join(timeout=max(0.0, primary.started_at + limit - time.monotonic()))
+        primary.cancel()
+
+        if primary.error is not None:
+            # 원래 요청이 실패하면 첫 토큰 도착 시간이 없으므로 표본에서 제외
+            ttft, saved = None, 0.0
+        else:
+            primary_first_at = primary.first_at if primary.first_at is not None else time.monotonic()
+            ttft = primary_first_at - primary.started_at
+            saved = max(0.0, primary_first_at - hedge_first_at)
+            self.tracker.record(self.model, ttft)
+        self.stats.record(True, True, saved)
+        self.hedge_info["primary_ttft"] = ttft
+        self.hedge_info["saved"] = saved
+
+    def __iter__(self):
+        self._winner = self._race()
+        if self._winner is None:
+            return
+        yield from self._winner.prefix
+        if not self._winner.exhausted:
+            yield from self._winner.iterator
+
+    def close(self):
+        """모든 요청의 연결을 닫습니다 (경쟁 중이면 대기를 깨워 빈 스트림으로 끝냄)."""
+        self._closed = True
+        self._events.put(("closed", None, None))
+        for racer in list(self._racers):
+            racer.cancel()
+
+
+class TimedStream:
+    """헤징 없이 첫 내용 청크 도착 시간만 기록하는 스트림 래퍼"""
+
+    def __init__(self, stream, model, started_at, tracker=ttft_tracker):
+        """
+        Args:
+            stream: 응답 스트림
+            model (str): 모델 이름
+            started_at (float): 요청을 보낸 시각 (time.monotonic 기준)
+            tracker (LatencyTracker): 첫 토큰 도착 시간 통계
+        """
+        self.stream = stream
+        self.model = model
+        self.tracker = tracker
+        self.started_at = started_at
+
+    def __iter__(self):
+        recorded = False
+        for chunk in self.stream:
+            if not recorded and chunk_has_content(chunk):
+                self.tracker.record(self.model, time.monotonic() - self.started_at)
+                recorded = True
+            yield chunk
+
+    def close(self):
+        close_stream(self.stream)
@@ -0,0 +1,170 @@
+"""
+파일 수집 모듈
+업로드된 파일의 형식과 크기를 내용을 읽기 전에 확인하고, 여러 파일을 스레드 풀에서 동시에 처리합니다.
+파일 내용의 해시로 이미 처리한 파일(이름만 다른 같은 파일 포함)은 다시 처리하지 않습니다.
+"""
+
+import os
+import time
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from modules.file_processor import process_file
+
+# 동시에 처리할 파일 수
+INGEST_WORKERS = 4
+
+# 해시 계산 시 한 번에 읽을 크기 (바이트)
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# 파일 종류별 최대 크기 (바이트) - JSON은 스트리밍으로 구조만 요약하므로 더 큰 파일을 허용
+# (요약은 초당 약 1MB이므로 최대 크기의 JSON은 처리에 1분 가까이 걸릴 수 있음)
+MAX_FILE_SIZES = {
+    "image": 5 * 1024 * 1024,
+    "text": 5 * 1024 * 1024,
+    "json": 50 * 1024 * 1024,
+}
+
+# 지원하는 이미지 MIME 형식
+IMAGE_TYPES = ("image/png", "image/jpeg", "image/gif", "image/webp")
+
+
+def file_kind(file):
+    """
+    파일의 MIME 형식으로 종류를 판별합니다.
+
+    Returns:
+        str | None: "image" | "text" | "json" (지원하지 않는 형식이면 None)
+    """
+    file_type = file.type or ""
+    if file_type == "application/json":
+        return "json"
+    if file_type.startswith("text/"):
+        return "text"
+    if file_type in IMAGE_TYPES:
+        return "image"
+    return None
+
+
+def file_size(file):
+    """파일 크기를 내용을 읽지 않고 반환합니다 (size 속성이 없으면 끝으로 이동하여 계산)."""
+    size = getattr(file, "size", None)
+    if size is not None:
+        return size
+    position = file.tell()
+    file.seek(0, os.SEEK_END)
+    size = file.tell()
+    file.seek(position)
+    return size
+
+
+def check_upload(file):
+    """
+    파일 내용을 읽기 전에 형식과 크기를 확인합니다.
+
+    Args:
+        file: 업로드된 파일 객체
+
+    Returns:
+        str | None: 오류 메시지 (문제가 없으면 None)
+    """
+    kind = file_kind(file)
+    if kind is None:
+        return f"지원되지 않는 파일 형식입니다 ({file.type})."
+    size = file_size(file)
+    if size > MAX_FILE_SIZES[kind]:
+        return (
+            f"파일이 너무 큽니다 ({size / 1024 / 1024:.1f} MB, "
+            f"{kind} 최대 {MAX_FILE_SIZES[kind] // 1024 // 1024} MB)."
+        )
+    return None
+
+
+def file_digest(file):
+    """
+    파일 내용의 SHA-256 해시를 조각 단위로 계산합니다 (파일 위치는 처음으로 되돌림).
+
+    Returns:
+        str: SHA-256 16진수 문자열
+    """
+    digest = hashlib.sha256()
+    file.seek(0)
+    for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b""):
+        digest.update(chunk)
+    file.seek(0)
+    return digest.hexdigest()
+
+
+def _ingest_one(file, claimed, lock):
+    """파일 하나를 확인, 해시, 처리합니다. (워커 스레드에서 호출)"""
+    started_at = time.perf_counter()
+    result = {"name": file.name, "status": "error", "info": None, "error": None, "hash": None}
+
+    error = check_upload(file)
+    if error is None:
+        result["hash"] = file_digest(file)
+        with lock:
+            duplicate_of = claimed.get(result["hash"])
+            if duplicate_of is None:
+                claimed[result["hash"]] = file.name
+
+        if duplicate_of is not None:
+            result["status"] = "duplicate"
+            result["error"] = f"{duplicate_of}과(와) 같은 파일입니다."
+        else:
+            ok, info = process_file(file)
+            if ok:
+                info["hash"] = result["hash"]
+                result["status"] = "ok"
+                result["info"] = info
+            else:
+                error = info
+                # 처리에 실패한 파일은 같은 내용을 다시 올릴 수 있도록 해시를 반환
+                with lock:
+                    claimed.pop(result["hash"], None)
+    if error is not None:
+        result["error"] = error
+
+    result["seconds"] = time.perf_counter() - started_at
+    return result
+
+
+def ingest_files(files, known_hashes=None, on_progress=None, max_workers=INGEST_WORKERS):
+    """
+    여러 파일을 스레드 풀에서 동시에 확인하고 처리합니다.
+
+    Args:
+        files (list): 업로드된 파일 객체 목록
+        known_hashes (dict): 이미 처리한 파일의 해시 -> 파일명 (같은 내용이면 건너뜀)
+        on_progress (callable): 파일 하나가 끝날 때마다 (완료 수, 전체 수, 결과)를 인자로
+            호출할 함수 (호출한 스레드에서 실행되므로 Streamlit 요소를 갱신해도 됨)
+        max_workers (int): 동시에 처리할 파일 수
+
+    Returns:
+        list: 파일별 결과 dict 목록 (입력 순서, name/status/info/error/hash/seconds)
+            status는 "ok" | "duplicate" | "error"
+    """
+    claimed = dict(known_hashes or {})
+    lock = threading.Lock()
+    results = [None] * len(files)
+
+    with ThreadPoolExecutor(
+        max_workers=max(1, min(max_workers, len(files))), thread_name_prefix="ingest"
+    ) as executor:
+        futures = {
+            executor.submit(_ingest_one, file, claimed, lock): index
+            for index, file in enumerate(files)
+        }
+        for done, future in enumerate(as_completed(futures), 1):
+            index = futures[future]
+            try:
+                results[index] = future.result()
+            except Exception as e:
+                results[index] = {
+                    "name": files[index].name, "status": "error", "info": None,
+                    "error": str(e), "hash": None, "seconds": 0.0,
+                }
+            if on_progress is not None:
+                on_progress(done, len(files), results[index])
+    return results
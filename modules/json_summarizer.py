@@ -0,0 +1,391 @@
+"""
+JSON 구조 요약 모듈
+대용량 JSON 문서를 메모리에 모두 올리지 않고 스트리밍 방식으로 검증하며,
+모델에 전달할 간결한 구조 요약(키 경로, 타입, 배열 길이, 샘플 값, 수치 범위)을 생성합니다.
+
+토큰마다 파이썬 코드로 처리하므로 작은 값이 많은 문서는 초당 약 1MB로 json.loads보다 10배 이상 느립니다
+(긴 문자열 값은 닫는 따옴표만 찾으므로 훨씬 빠름). 최대 크기(50MB)의 JSON은 요약에 1분 가까이 걸릴 수 있습니다.
+"""
+
+import re
+import json
+import codecs
+
+# 한 번에 읽어들일 바이트 수
+CHUNK_SIZE = 64 * 1024
+
+# 요약에 기록할 최대 경로 수 (초과하는 경로의 값은 개수만 집계)
+MAX_PATHS = 100
+
+# 직렬화한 요약의 최대 길이 (첨부 메시지의 10,000자 제한)
+# 경로 수만으로는 키/샘플 길이에 따라 넘을 수 있으므로 직렬화할 때 샘플과 경로를 줄여 맞춤
+MAX_SUMMARY_CHARS = 10000
+
+# 경로별로 보관할 샘플 값 수와 샘플 문자열 최대 길이
+MAX_SAMPLES = 3
+MAX_SAMPLE_LENGTH = 80
+
+_WHITESPACE_RE = re.compile(r"[ \t\n\r]*")
+_TOKEN_RE = re.compile(
+    r'(?P<punct>[{}\[\]:,])'
+    r'|(?P<string>"[^"\\]*(?:\\.[^"\\]*)*")'
+    r'|(?P<number>-?(?:0|[1-9]\d*)(?:\.\d+)?(?:[eE][+-]?\d+)?)'
+    r'|(?P<literal>true|false|null)'
+)
+# 버퍼 끝에서 잘린 숫자의 나머지일 수 있는 문자열
+_NUMBER_TAIL_RE = re.compile(r"[0-9.eE+\-]*")
+# 문자열 안에서 따옴표/역슬래시가 아닌 문자 구간
+_STRING_BODY_RE = re.compile(r'[^"\\]*')
+_LITERALS = {"true": True, "false": False, "null": None}
+
+
+class _PathStats:
+    """하나의 키 경로에 대한 통계"""
+
+    __slots__ = ("types", "count", "samples", "min", "max", "min_len", "max_len")
+
+    def __init__(self):
+        self.types = {}
+        self.count = 0
+        self.samples = []
+        self.min = None
+        self.max = None
+        self.min_len = None
+        self.max_len = None
+
+    def add_scalar(self, type_name, value):
+        self.count += 1
+        self.types[type_name] = self.types.get(type_name, 0) + 1
+
+        if type_name == "number":
+            self.min = value if self.min is None else min(self.min, value)
+            self.max = value if self.max is None else max(self.max, value)
+
+        if len(self.samples) < MAX_SAMPLES:
+            if isinstance(value, str) and len(value) > MAX_SAMPLE_LENGTH:
+                value = value[:MAX_SAMPLE_LENGTH] + "…"
+            if value not in self.samples:
+                self.samples.append(value)
+
+    def add_container(self, type_name, length):
+        self.count += 1
+        self.types[type_name] = self.types.get(type_name, 0) + 1
+        self.min_len = length if self.min_len is None else min(self.min_len, length)
+        self.max_len = length if self.max_len is None else max(self.max_len, length)
+
+    def to_dict(self):
+        result = {"types": self.types, "count": self.count}
+        if self.min_len is not None:
+            result["length"] = [self.min_len, self.max_len]
+        if self.min is not None:
+            result["range"] = [self.min, self.max]
+        if self.samples:
+            result["samples"] = self.samples
+        return result
+
+
+class _Frame:
+    """파싱 중인 컨테이너(객체/배열) 상태"""
+
+    __slots__ = ("kind", "path", "length", "state", "key")
+
+    def __init__(self, kind, path):
+        self.kind = kind      # "object" 또는 "array"
+        self.path = path
+        self.length = 0
+        # object: "key" | "colon" | "value" | "next", array: "value" | "next"
+        self.state = "key" if kind == "object" else "value"
+        self.key = None
+
+
+class JsonSummarizer:
+    """
+    토큰 단위로 JSON을 읽으며 문법을 검증하고 경로별 통계를 수집하는 클래스.
+    배열의 인덱스는 `[]`로 합쳐지므로 요소 수와 관계없이 메모리 사용량이 경로 수에 비례합니다.
+    """
+
+    def __init__(self, max_paths=MAX_PATHS):
+        self.max_paths = max_paths
+        self.paths = {}
+        # 경로 수 제한으로 기록하지 못한 값의 수 (서로 다른 경로 수가 아니라 값 단위로 집계하여 메모리 고정)
+        self.untracked_values = 0
+        self.total_values = 0
+        self._stack = []
+        self._done = False
+
+    def _stats(self, path):
+        stats = self.paths.get(path)
+        if stats is None:
+            if len(self.paths) >= self.max_paths:
+                self.untracked_values += 1
+                return None
+            stats = self.paths[path] = _PathStats()
+        return stats
+
+    def _child_path(self):
+        """현재 위치에 오는 값의 경로를 반환하고, 부모 컨테이너 상태를 갱신합니다."""
+        if self._done:
+            raise ValueError("문서 끝 이후에 추가 데이터가 있습니다.")
+        if not self._stack:
+            return "$"
+
+        frame = self._stack[-1]
+        if frame.state != "value":
+            raise ValueError("값이 올 수 없는 위치입니다.")
+        frame.state = "next"
+        frame.length += 1
+        if frame.kind == "array":
+            return f"{frame.path}[]"
+        return f"{frame.path}.{frame.key}"
+
+    def _scalar(self, type_name, value):
+        path = self._child_path()
+        self.total_values += 1
+        stats = self._stats(path)
+        if stats is not None:
+            stats.add_scalar(type_name, value)
+        if not self._stack:
+            self._done = True
+
+    def feed_token(self, kind, text):
+        """
+        토큰 하나를 처리합니다.
+
+        Args:
+            kind (str): 토큰 종류 (punct, string, number, literal)
+            text (str): 토큰 원문
+
+        Raises:
+            ValueError: JSON 문법에 맞지 않는 토큰인 경우
+        """
+        frame = self._stack[-1] if self._stack else None
+
+        if kind == "string":
+            value = json.loads(text)
+            if frame is not None and frame.kind == "object" and frame.state == "key":
+                frame.key = value
+                frame.state = "colon"
+                return
+            self._scalar("string", value)
+
+        elif kind == "number":
+            self._scalar("number", float(text) if any(c in text for c in ".eE") else int(text))
+
+        elif kind == "literal":
+            value = _LITERALS[text]
+            self._scalar("null" if value is None else "boolean", value)
+
+        elif text in "{[":
+            path = self._child_path()
+            self.total_values += 1
+            self._stack.append(_Frame("object" if text == "{" else "array", path))
+
+        elif text in "}]":
+            expected = "object" if text == "}" else "array"
+            if frame is None or frame.kind != expected:
+                raise ValueError(f"예상하지 못한 '{text}' 입니다.")
+            # 빈 컨테이너이거나 마지막 값 뒤에서만 닫을 수 있음
+            empty_ok = frame.length == 0 and frame.state in ("key", "value")
+            if not (empty_ok or frame.state == "next"):
+                raise ValueError(f"예상하지 못한 '{text}' 입니다.")
+            self._stack.pop()
+            stats = self._stats(frame.path)
+            if stats is not None:
+                stats.add_container(frame.kind, frame.length)
+            if not self._stack:
+                self._done = True
+
+        elif text == ":":
+            if frame is None or frame.state != "colon":
+                raise ValueError("예상하지 못한 ':' 입니다.")
+            frame.state = "value"
+
+        elif text == ",":
+            if frame is None or frame.state != "next":
+                raise ValueError("예상하지 못한 ',' 입니다.")
+            frame.state = "key" if frame.kind == "object" else "value"
+
+    def finish(self):
+        """
+        문서 파싱을 마무리하고 요약을 반환합니다.
+
+        Returns:
+            dict: 구조 요약
+
+        Raises:
+            ValueError: 문서가 완결되지 않은 경우
+        """
+        if not self._done:
+            raise ValueError("JSON 문서가 완결되지 않았습니다.")
+
+        summary = {
+            "values": self.total_values,
+            "paths": {path: self.paths[path].to_dict() for path in sorted(self.paths)},
+        }
+        if self.untracked_values:
+            summary["untracked_values"] = self.untracked_values
+        return summary
+
+
+def _path_depth(path):
+    return path.count(".") + path.count("[]")
+
+
+def encode_summary(summary, max_chars=MAX_SUMMARY_CHARS):
+    """
+    구조 요약을 첨부용 JSON 문자열로 직렬화합니다.
+    max_chars를 넘으면 경로별 샘플 값을 먼저 줄이고, 그래도 넘으면 깊은 경로부터 생략하며
+    줄인 내용은 "truncated" 항목에 기록합니다 (잘린 JSON이 전달되지 않도록 항상 완결된 문서를 반환).
+
+    Args:
+        summary (dict): summarize_json_stream이 반환한 구조 요약
+        max_chars (int): 직렬화 결과의 최대 길이
+
+    Returns:
+        str: 직렬화된 요약
+    """
+    def dump(value):
+        return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+
+    text = dump(summary)
+    if len(text) <= max_chars:
+        return text
+
+    paths = {path: dict(stats) for path, stats in summary["paths"].items()}
+    truncated = {"max_chars": max_chars}
+    trimmed = dict(summary, paths=paths, truncated=truncated)
+
+    # 1단계: 경로별 샘플 값을 하나씩 줄임
+    for keep in range(MAX_SAMPLES - 1, -1, -1):
+        for stats in paths.values():
+            if len(stats.get("samples", ())) > keep:
+                if keep:
+                    stats["samples"] = stats["samples"][:keep]
+                else:
+                    del stats["samples"]
+        truncated["samples_per_path"] = keep
+        text = dump(trimmed)
+        if len(text) <= max_chars:
+            return text
+
+    # 2단계: 깊은 경로부터 생략 (같은 깊이면 뒤쪽 경로부터)
+    order = sorted(paths, key=lambda path: (_path_depth(path), path))
+    while order:
+        del paths[order.pop()]
+        truncated["omitted_paths"] = truncated.get("omitted_paths", 0) + 1
+        text = dump(trimmed)
+        if len(text) <= max_chars:
+            return text
+    return text
+
+
+def _scan_string(text, pos, escaped):
+    """
+    조각 단위로 이어지는 문자열 토큰에서 닫는 따옴표를 찾습니다.
+
+    Args:
+        text (str): 검사할 텍스트
+        pos (int): 검사를 시작할 위치
+        escaped (bool): 직전 조각이 역슬래시로 끝났는지 여부
+
+    Returns:
+        tuple: (닫는 따옴표 위치 (없으면 -1), 텍스트 끝이 역슬래시로 끝났는지 여부)
+    """
+    length = len(text)
+    while pos < length:
+        if escaped:
+            pos += 1
+            escaped = False
+            continue
+        pos = _STRING_BODY_RE.match(text, pos).end()
+        if pos >= length:
+            break
+        if text[pos] == '"':
+            return pos, False
+        escaped = True
+        pos += 1
+    return -1, escaped
+
+
+def summarize_json_stream(stream, chunk_size=CHUNK_SIZE, max_paths=MAX_PATHS):
+    """
+    파일 형태의 바이너리 스트림을 조각 단위로 읽으며 JSON을 검증하고 구조를 요약합니다.
+    하나의 토큰(긴 문자열 등)을 제외하면 문서 크기와 무관한 메모리만 사용합니다.
+
+    Args:
+        stream: read(size)를 지원하는 바이너리 스트림
+        chunk_size (int): 한 번에 읽을 바이트 수
+        max_paths (int): 요약에 기록할 최대 경로 수
+
+    Returns:
+        tuple: (구조 요약(dict), 읽은 바이트 수(int))
+
+    Raises:
+        ValueError: JSON 문법 오류 또는 UTF-8 디코딩 오류가 있는 경우
+    """
+    summarizer = JsonSummarizer(max_paths=max_paths)
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    buffer = ""
+    total_bytes = 0
+    eof = False
+    # 조각 경계를 넘는 문자열 토큰의 읽은 부분과 마지막 조각이 역슬래시로 끝났는지 여부
+    # (긴 문자열을 매번 처음부터 다시 검사하거나 버퍼를 다시 만들지 않도록 새 조각만 검사)
+    string_parts = None
+    string_escaped = False
+
+    while True:
+        if not eof:
+            chunk = stream.read(chunk_size)
+            if chunk:
+                total_bytes += len(chunk)
+                text = decoder.decode(chunk)
+            else:
+                text = decoder.decode(b"", final=True)
+                eof = True
+
+            if string_parts is None:
+                buffer += text
+            else:
+                end, string_escaped = _scan_string(text, 0, string_escaped)
+                if end < 0:
+                    string_parts.append(text)
+                    if eof:
+                        raise ValueError("문자열이 끝나지 않았습니다.")
+                    continue
+                string_parts.append(text[:end + 1])
+                summarizer.feed_token("string", "".join(string_parts))
+                string_parts = None
+                buffer = text[end + 1:]
+
+        pos = 0
+        length = len(buffer)
+        while True:
+            pos = _WHITESPACE_RE.match(buffer, pos).end()
+            if pos >= length:
+                break
+            match = _TOKEN_RE.match(buffer, pos)
+            if not eof and match is None and buffer[pos] == '"':
+                # 닫히지 않은 문자열은 다음 조각부터 이어서 닫는 따옴표만 찾음
+                string_parts = [buffer[pos:]]
+                string_escaped = _scan_string(buffer, pos + 1, False)[1]
+                pos = length
+                break
+            # 버퍼 끝에 걸친 토큰은 다음 조각을 읽은 뒤 다시 시도
+            # (충분히 긴 데이터와도 맞지 않으면 즉시 오류 처리)
+            if not eof and match is None and length - pos < 64:
+                break
+            if not eof and match is not None and (
+                match.end() == length
+                or (match.lastgroup == "number" and _NUMBER_TAIL_RE.fullmatch(buffer, match.end()))
+            ):
+                break
+            if match is None:
+                raise ValueError(f"잘못된 JSON 토큰입니다: {buffer[pos:pos + 20]!r}")
+            summarizer.feed_token(match.lastgroup, match.group())
+            pos = match.end()
+        buffer = buffer[pos:]
+
+        if eof:
+            break
+
+    return summarizer.finish(), total_bytes
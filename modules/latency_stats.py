@@ -0,0 +1,72 @@
+"""
+지연 시간 통계 모듈
+모델별 첫 토큰 도착 시간(TTFT) 등 최근 지연 시간 표본을 보관하고 백분위수를 계산합니다.
+"""
+
+import threading
+from collections import deque
+
+# 모델별로 보관할 최근 표본 수
+DEFAULT_WINDOW = 200
+
+
+class LatencyTracker:
+    """모델별 최근 지연 시간 표본을 스레드 안전하게 보관하는 클래스"""
+
+    def __init__(self, window=DEFAULT_WINDOW):
+        """
+        Args:
+            window (int): 모델별로 보관할 최근 표본 수
+        """
+        self.window = window
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def record(self, model, seconds):
+        """
+        지연 시간 표본을 기록합니다.
+
+        Args:
+            model (str): 모델 이름
+            seconds (float): 측정된 지연 시간(초)
+        """
+        with self._lock:
+            samples = self._samples.get(model)
+            if samples is None:
+                samples = self._samples[model] = deque(maxlen=self.window)
+            samples.append(seconds)
+
+    def samples(self, model):
+        """모델의 최근 표본 목록(복사본)을 반환합니다."""
+        with self._lock:
+            return list(self._samples.get(model, ()))
+
+    def count(self, model):
+        """모델의 표본 수를 반환합니다."""
+        with self._lock:
+            return len(self._samples.get(model, ()))
+
+    def percentile(self, model, q):
+        """
+        모델의 최근 표본에서 백분위수를 계산합니다 (최근접 순위 방식).
+
+        Args:
+            model (str): 모델 이름
+            q (float): 백분위 (0~100)
+
+        Returns:
+            float | None: 백분위수 (표본이 없으면 None)
+        """
+        samples = sorted(self.samples(model))
+        if not samples:
+            return None
+        rank = max(1, -(-len(samples) * q // 100))  # 올림
+        return samples[int(rank) - 1]
+
+    def p95(self, model):
+        """모델의 p95 지연 시간을 반환합니다."""
+        return self.percentile(model, 95)
+
+
+# 프로세스 전체에서 공유하는 첫 토큰 도착 시간(TTFT) 통계
+ttft_tracker = LatencyTracker()
@@ -0,0 +1,144 @@
+"""
+모델 레지스트리 모듈
+Sonar 모델별 컨텍스트 윈도우, 이미지 지원, 능력 등급 등 고정 정보를 한곳에서 관리하고,
+첫 토큰 도착 시간(TTFT)과 사용량 원장으로 모델별 실시간 지연 시간/비용 통계를 제공합니다.
+"""
+
+from modules.latency_stats import ttft_tracker
+
+# 모델별 고정 정보 (표시 순서 유지)
+# - context_window: 컨텍스트 윈도우 (토큰)
+# - images: 이미지 입력 지원 여부
+# - tier: 능력 등급 (높을수록 복잡한 요청에 적합하지만 느리고 비쌈)
+# - capabilities: 적합한 요청 유형 ("research"가 있는 모델은 매우 느리고 비싸므로 심층 조사 요청에만 사용)
+# - typical_ttft: 관측 표본이 부족할 때 사용할 첫 토큰 도착 시간 사전값(초)
+# - price_per_million: 입력/출력 100만 토큰당 가격(USD, 참고용이며 요청/검색 수수료는 제외)
+MODELS = {
+    "sonar-deep-research": {
+        "label": "Sonar Deep Research",
+        "context_window": 128000,
+        "images": False,
+        "tier": 4,
+        "capabilities": ("research",),
+        "typical_ttft": 60.0,
+        "price_per_million": (2.0, 8.0),
+    },
+    "sonar-reasoning-pro": {
+        "label": "Sonar Reasoning Pro",
+        "context_window": 128000,
+        "images": True,
+        "tier": 3,
+        "capabilities": ("search", "reasoning"),
+        "typical_ttft": 6.0,
+        "price_per_million": (2.0, 8.0),
+    },
+    "sonar-reasoning": {
+        "label": "Sonar Reasoning",
+        "context_window": 128000,
+        "images": True,
+        "tier": 2,
+        "capabilities": ("search", "reasoning"),
+        "typical_ttft": 4.0,
+        "price_per_million": (1.0, 5.0),
+    },
+    "sonar-pro": {
+        "label": "Sonar Pro",
+        "context_window": 200000,
+        "images": True,
+        "tier": 2,
+        "capabilities": ("search",),
+        "typical_ttft": 2.5,
+        "price_per_million": (3.0, 15.0),
+    },
+    "sonar": {
+        "label": "Sonar",
+        "context_window": 128000,
+        "images": True,
+        "tier": 1,
+        "capabilities": ("search",),
+        "typical_ttft": 1.5,
+        "price_per_million": (1.0, 1.0),
+    },
+}
+
+DEFAULT_MODEL = "sonar"
+DEFAULT_CONTEXT_WINDOW = 128000
+
+# 관측된 TTFT를 사전값 대신 사용하기 위해 필요한 최소 표본 수
+MIN_TTFT_SAMPLES = 10
+
+
+def model_names():
+    """등록된 모델 이름 목록을 표시 순서대로 반환합니다."""
+    return list(MODELS)
+
+
+def get_model(model):
+    """모델 정보를 반환합니다 (등록되지 않은 모델이면 None)."""
+    return MODELS.get(model)
+
+
+def context_window(model):
+    """모델의 컨텍스트 윈도우(토큰)를 반환합니다."""
+    spec = MODELS.get(model)
+    return spec["context_window"] if spec else DEFAULT_CONTEXT_WINDOW
+
+
+def supports_images(model):
+    """모델이 이미지 입력을 지원하는지 반환합니다 (등록되지 않은 모델은 지원한다고 가정)."""
+    spec = MODELS.get(model)
+    return spec["images"] if spec else True
+
+
+def expected_ttft(model, tracker=ttft_tracker):
+    """
+    모델의 예상 첫 토큰 도착 시간(p95)을 반환합니다.
+    관측 표본이 MIN_TTFT_SAMPLES 이상이면 관측값, 아니면 레지스트리의 사전값을 사용합니다.
+
+    Returns:
+        tuple: (초, 출처 "observed" | "prior")
+    """
+    if tracker.count(model) >= MIN_TTFT_SAMPLES:
+        return tracker.p95(model), "observed"
+    spec = MODELS.get(model)
+    return (spec["typical_ttft"] if spec else None), "prior"
+
+
+def estimate_cost(model, prompt_tokens, completion_tokens):
+    """
+    토큰 수로 비용(USD)을 추정합니다 (등록되지 않은 모델이면 None).
+    """
+    spec = MODELS.get(model)
+    if spec is None:
+        return None
+    input_price, output_price = spec["price_per_million"]
+    return (prompt_tokens * input_price + completion_tokens * output_price) / 1_000_000
+
+
+def model_stats(model, ledger=None, tracker=ttft_tracker):
+    """
+    모델의 실시간 지연 시간/비용 통계를 반환합니다.
+
+    Args:
+        model (str): 모델 이름
+        ledger (UsageLedger): 사용량 원장 (None이면 공유 원장 사용)
+        tracker (LatencyTracker): TTFT 통계
+
+    Returns:
+        dict: TTFT p95와 출처, TTFT 표본 수, 요청 수, 요청당 평균 토큰, 요청당 추정 비용
+    """
+    if ledger is None:
+        from modules.usage_ledger import usage_ledger as ledger
+
+    ttft, source = expected_ttft(model, tracker)
+    totals = ledger.totals(model=model)
+    requests = totals["requests"]
+    cost = estimate_cost(model, totals["prompt_tokens"], totals["completion_tokens"])
+    return {
+        "ttft_p95": ttft,
+        "ttft_source": source,
+        "ttft_samples": tracker.count(model),
+        "requests": requests,
+        "avg_tokens": totals["total_tokens"] / requests if requests else None,
+        "avg_cost": cost / requests if requests and cost is not None else None,
+    }
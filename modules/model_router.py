@@ -0,0 +1,224 @@
+"""
+자동 모델 선택 모듈
+프롬프트 특징(심층 조사/추론 요청 여부, 길이), 첨부 파일(이미지), 컨텍스트 크기로 요청에 적합한 모델을 추리고,
+그중 관측된 p95 첫 토큰 도착 시간이 가장 짧은 모델을 선택합니다.
+"""
+
+import re
+
+from modules.latency_stats import ttft_tracker
+from modules.model_registry import MODELS, expected_ttft
+from modules.usage_ledger import estimate_prompt_tokens
+from modules.api_client import estimate_tokens
+from modules.payload_builder import EncodedMessages
+
+# 사이드바에서 자동 선택을 나타내는 모델 값
+AUTO_MODEL = "auto"
+
+# 심층 조사를 명시적으로 요청하는 표현 (조사/보고서 작성 의도가 드러나야 함)
+RESEARCH_INTENT_PATTERN = re.compile(
+    r"심층\s*(?:조사|리서치|분석|보고서)|(?:보고서|리포트)\s*(?:를|을)?\s*(?:작성|써|만들)"
+    r"|문헌\s*(?:조사|검토)|리서치\s*(?:해|를\s*해)"
+    r"|\bdeep[- ]research\b|\bin-depth\s+(?:research|analysis|report)\b|\bliterature\s+review\b"
+    r"|\b(?:write|prepare|compile|draft|produce)\b[^.?!\n]{0,40}\b(?:report|survey|literature\s+review)\b",
+    re.IGNORECASE,
+)
+
+# 심층 조사 요청일 가능성을 높이는 표현 (서로 다른 표현마다 점수 1, 단독으로는 판단하지 않음)
+RESEARCH_HINT_PATTERNS = [
+    re.compile(pattern, re.IGNORECASE)
+    for pattern in (
+        r"심층", r"조사해", r"리서치", r"보고서|리포트", r"문헌", r"동향", r"시장\s*분석",
+        r"\bresearch\b", r"\breports?\b", r"\bsurvey\b", r"\bliterature\b",
+        r"\bin-depth\b", r"\bcomprehensive\b",
+    )
+]
+
+# 명시적 요청 표현의 점수와 심층 조사로 판단하는 최소 점수
+RESEARCH_INTENT_SCORE = 2
+RESEARCH_SCORE_THRESHOLD = 3
+
+# 이 토큰 수 이상의 프롬프트는 심층 조사 점수 1 추가 (짧은 질문은 일반 검색으로 충분)
+RESEARCH_LONG_PROMPT_TOKENS = 40
+
+# 추론이 필요한 요청으로 판단하는 표현
+REASONING_PATTERN = re.compile(
+    r"왜|이유|증명|추론|분석|비교|단계별|계산|풀어|설계|장단점"
+    r"|\bwhy\b|\bprove\b|\breason(?:ing)?\b|\banaly[sz]e\b|\bcompare\b|\bstep[- ]by[- ]step\b"
+    r"|\bcalculate\b|\bsolve\b|\btrade-?offs?\b",
+    re.IGNORECASE,
+)
+
+# 코드 블록이나 수식이 있으면 추론 모델 사용
+CODE_OR_MATH_PATTERN = re.compile(r"```|\\\(|\\\[|\$\$|[=<>]\s*\d")
+
+# 이 토큰 수를 넘는 프롬프트(첨부 포함)는 등급 2 이상 모델 사용
+LONG_PROMPT_TOKENS = 1500
+
+# 요청 유형별 필요한 능력과 설명
+NEEDS = {
+    "research": "심층 조사",
+    "reasoning": "추론",
+    "search": "일반 검색",
+}
+
+
+def _last_user_message(messages):
+    if isinstance(messages, EncodedMessages):
+        # 지난 메시지는 직렬화 바이트만 있으므로 새 메시지만 사용
+        last = messages.last_message
+        return last if last is not None and last.get("role") == "user" else None
+    for message in reversed(messages):
+        if message.get("role") == "user":
+            return message
+    return None
+
+
+def research_score(prompt, prompt_tokens):
+    """
+    프롬프트가 심층 조사 요청인지 판단하기 위한 점수를 계산합니다.
+    명시적 요청 표현(RESEARCH_INTENT_SCORE), 서로 다른 관련 표현(각 1), 긴 프롬프트(1)를 더합니다.
+
+    Returns:
+        tuple: (점수, 명시적 요청 표현 포함 여부)
+    """
+    intent = RESEARCH_INTENT_PATTERN.search(prompt) is not None
+    score = RESEARCH_INTENT_SCORE if intent else 0
+    score += sum(1 for pattern in RESEARCH_HINT_PATTERNS if pattern.search(prompt))
+    if prompt_tokens >= RESEARCH_LONG_PROMPT_TOKENS:
+        score += 1
+    return score, intent
+
+
+def prompt_features(messages):
+    """
+    마지막 사용자 메시지에서 모델 선택에 사용할 특징을 추출합니다.
+
+    Args:
+        messages (list | EncodedMessages): API 요청 메시지 목록
+
+    Returns:
+        dict: 요청 유형(need), 최소 등급(min_tier), 이미지 포함 여부, 프롬프트/첨부 토큰 추정, 판단 이유 목록
+    """
+    message = _last_user_message(messages) or {"content": ""}
+    content = message.get("content")
+    parts = [{"type": "text", "text": content}] if isinstance(content, str) else (content or [])
+
+    prompt = parts[0].get("text", "") if parts else ""
+    has_images = any(part.get("type") == "image_url" for part in parts)
+    attachment_tokens = sum(
+        estimate_tokens(part.get("content") or part.get("text") or "")
+        for part in parts[1:]
+        if part.get("type") != "image_url"
+    )
+    prompt_tokens = estimate_tokens(prompt)
+
+    reasons = []
+    score, intent = research_score(prompt, prompt_tokens)
+    # 명시적 요청 표현이 있고 점수가 충분할 때만 심층 조사 (보고서/동향 등 단어 하나로는 판단하지 않음)
+    if intent and score >= RESEARCH_SCORE_THRESHOLD:
+        need = "research"
+        reasons.append(f"심층 조사 요청 표현 (점수 {score})")
+    elif REASONING_PATTERN.search(prompt) or CODE_OR_MATH_PATTERN.search(prompt):
+        need = "reasoning"
+        reasons.append("추론/분석 요청 표현 또는 코드·수식")
+    else:
+        need = "search"
+
+    min_tier = 1
+    if prompt_tokens + attachment_tokens > LONG_PROMPT_TOKENS:
+        min_tier = 2
+        reasons.append(f"긴 프롬프트/첨부 (약 {prompt_tokens + attachment_tokens} 토큰)")
+    if has_images:
+        reasons.append("이미지 첨부")
+
+    return {
+        "need": need,
+        "min_tier": min_tier,
+        "has_images": has_images,
+        "prompt_tokens": prompt_tokens,
+        "attachment_tokens": attachment_tokens,
+        "reasons": reasons,
+    }
+
+
+def route_model(messages, max_tokens, tracker=ttft_tracker):
+    """
+    요청에 적합한 모델 중 예상 첫 토큰 도착 시간(p95)이 가장 짧은 모델을 선택합니다.
+    적합한 모델이 없으면 요청 유형 조건을 빼고 컨텍스트/이미지 조건만 맞는 가장 높은 등급의 모델을 선택합니다.
+
+    Args:
+        messages (list): API 요청 메시지 목록
+        max_tokens (int): 요청할 최대 토큰 수 (컨텍스트 윈도우 확인용)
+        tracker (LatencyTracker): TTFT 통계
+
+    Returns:
+        dict: 선택 결과 (model, need, reasons, prompt_tokens_estimate, candidates, fallback)
+    """
+    features = prompt_features(messages)
+    total_tokens = estimate_prompt_tokens(messages)
+
+    def fits(spec):
+        if spec["context_window"] < total_tokens + max_tokens:
+            return False
+        # 심층 조사 모델은 심층 조사 요청일 때만 후보 (대체 선택 포함)
+        if "research" in spec["capabilities"] and features["need"] != "research":
+            return False
+        return spec["images"] or not features["has_images"]
+
+    candidates = []
+    for name, spec in MODELS.items():
+        if not fits(spec):
+            continue
+        if features["need"] not in spec["capabilities"] or spec["tier"] < features["min_tier"]:
+            continue
+        ttft, source = expected_ttft(name, tracker)
+        candidates.append({"model": name, "ttft_p95": ttft, "source": source, "tier": spec["tier"]})
+
+    fallback = not candidates
+    if candidates:
+        # 가장 빠른 모델, 같으면 낮은 등급(저렴한) 모델
+        chosen = min(
+            candidates,
+            key=lambda c: (c["ttft_p95"] if c["ttft_p95"] is not None else float("inf"), c["tier"]),
+        )["model"]
+    else:
+        fitting = [name for name, spec in MODELS.items() if fits(spec)]
+        if fitting:
+            chosen = max(fitting, key=lambda name: MODELS[name]["tier"])
+        else:
+            # 어떤 모델에도 맞지 않으면 컨텍스트 윈도우가 가장 큰 모델 (요청 전 확인에서 오류 처리)
+            chosen = max(MODELS, key=lambda name: MODELS[name]["context_window"])
+
+    return {
+        "mode": AUTO_MODEL,
+        "model": chosen,
+        "need": features["need"],
+        "min_tier": features["min_tier"],
+        "has_images": features["has_images"],
+        "reasons": features["reasons"],
+        "prompt_tokens_estimate": total_tokens,
+        "candidates": [
+            {k: c[k] for k in ("model", "ttft_p95", "source")} for c in candidates
+        ],
+        "fallback": fallback,
+    }
+
+
+def describe_routing(routing):
+    """
+    선택 결과를 한 줄 설명으로 만듭니다.
+
+    Returns:
+        str: 설명 문자열
+    """
+    chosen = next((c for c in routing["candidates"] if c["model"] == routing["model"]), None)
+    text = f"{routing['model']} (요청 유형: {NEEDS.get(routing['need'], routing['need'])}"
+    if routing["reasons"]:
+        text += f", 근거: {', '.join(routing['reasons'])}"
+    if chosen is not None and chosen["ttft_p95"] is not None:
+        source = "관측" if chosen["source"] == "observed" else "사전값"
+        text += f", 예상 첫 토큰 p95 {chosen['ttft_p95']:.1f}초({source})"
+    if routing["fallback"]:
+        text += ", 조건에 맞는 모델이 없어 가장 높은 등급 모델 사용"
+    return text + ")"
@@ -0,0 +1,327 @@
+"""
+요청 본문 생성 모듈
+첨부 항목(base64 이미지, 텍스트 첨부)은 세션 저장소에 API 요청 형식의 JSON 바이트로 한 벌만 보관되므로,
+요청 본문은 이 바이트 조각을 다시 직렬화하거나 복사하지 않고 순서대로 전송합니다.
+턴마다 직렬화하는 것은 메시지의 짧은 텍스트 부분뿐이므로 base64 이미지가 포함된 긴 대화에서도
+요청당 인코딩 시간이 첨부 크기와 무관하게 유지됩니다. 메시지별 추정 토큰 수는 캐시하여 새 메시지만 계산합니다.
+
+사용 예:
+    # 벤치마크: python -m modules.payload_builder --turns 40 --image-kb 512
+"""
+
+import json
+import threading
+from collections import OrderedDict
+
+from modules.session_store import session_store, is_blob_ref, encode_json, SESSION_MEMORY_BUDGET
+
+# 추정 토큰 수 캐시 항목 수 상한
+PAYLOAD_CACHE_MAX_ENTRIES = 10000
+
+
+class RequestBody:
+    """
+    직렬화된 조각들로 이루어진 요청 본문.
+    httpx에 content로 넘기면 조각을 하나로 합치지 않고 순서대로 전송합니다 (여러 번 반복 가능).
+    """
+
+    def __init__(self, chunks):
+        """
+        Args:
+            chunks (list): 본문을 이루는 bytes 조각 목록
+        """
+        self.chunks = chunks
+        self.length = sum(len(chunk) for chunk in chunks)
+
+    def __iter__(self):
+        return iter(self.chunks)
+
+    def __len__(self):
+        return self.length
+
+    def __bytes__(self):
+        return b"".join(self.chunks)
+
+
+class EncodedMessages:
+    """
+    API 요청 메시지 목록의 직렬화 바이트 조각과 요청 전 확인에 필요한 요약 정보.
+    지난 메시지는 실제 값으로 되돌리지 않고 바이트 조각만 보관합니다.
+    """
+
+    def __init__(self, encoded, prompt_tokens, last_message=None):
+        """
+        Args:
+            encoded (list): 메시지별 직렬화 바이트 조각 목록 (요청 순서)
+            prompt_tokens (int): 전체 메시지의 추정 프롬프트 토큰 수
+            last_message (dict): 마지막 메시지 (실제 값으로 바꾼 것, 모델 자동 선택 등에 사용)
+        """
+        self.encoded = encoded
+        self.prompt_tokens = prompt_tokens
+        self.last_message = last_message
+
+    def __len__(self):
+        return len(self.encoded)
+
+    def digest_source(self):
+        """해시 계산용으로 메시지 직렬화 바이트를 이어 붙여 반환합니다."""
+        return b"[" + b",".join(b"".join(chunks) for chunks in self.encoded) + b"]"
+
+    def body(self, **fields):
+        """
+        메시지 목록과 나머지 요청 필드로 /chat/completions 요청 본문을 만듭니다.
+
+        Args:
+            **fields: model, temperature, max_tokens, stream 등 요청 필드
+
+        Returns:
+            RequestBody: 요청 본문
+        """
+        head = encode_json(fields)[:-1]
+        chunks = [head + (b',"messages":[' if fields else b'"messages":[')]
+        for index, message_chunks in enumerate(self.encoded):
+            if index:
+                chunks.append(b",")
+            chunks.extend(message_chunks)
+        chunks.append(b"]}")
+        return RequestBody(chunks)
+
+
+class PayloadCache:
+    """
+    대화 기록의 메시지를 요청 본문 조각으로 바꾸고 메시지 객체별 추정 토큰 수를 캐시하는 클래스.
+    첨부 항목은 세션 저장소의 JSON 바이트를 그대로 사용하므로 캐시에는 바이트를 따로 보관하지 않으며,
+    세션 저장소에서 세션이 삭제되면 해당 세션의 항목도 제거됩니다.
+    """
+
+    def __init__(self, store=session_store, max_entries=PAYLOAD_CACHE_MAX_ENTRIES):
+        """
+        Args:
+            store (SessionStore): 첨부 항목이 보관된 세션 저장소
+            max_entries (int): 캐시 항목 수 상한 (넘으면 오래된 항목부터 제거)
+        """
+        self.store = store
+        self.max_entries = max_entries
+        # id(원본 메시지) -> (원본 메시지, 세션 ID, 추정 토큰 수), 오래된 것이 앞
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        store.add_drop_listener(self.drop_session)
+
+    def _cached_tokens(self, session_id, source):
+        with self._lock:
+            entry = self._entries.get(id(source))
+            # 같은 id라도 다른 객체일 수 있으므로 원본 객체가 같은지 확인
+            if entry is None or entry[0] is not source or entry[1] != session_id:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(id(source))
+            self.hits += 1
+            return entry[2]
+
+    def _remember(self, session_id, source, tokens):
+        with self._lock:
+            self._entries.pop(id(source), None)
+            self._entries[id(source)] = (source, session_id, tokens)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _prune(self, session_id, messages):
+        """대화 기록에 더 이상 없는 세션 메시지의 캐시 항목을 제거합니다 (대화 불러오기 등)."""
+        live = {id(message) for message in messages}
+        with self._lock:
+            for key in [
+                key for key, entry in self._entries.items()
+                if entry[1] == session_id and key not in live
+            ]:
+                del self._entries[key]
+
+    def drop_session(self, session_id):
+        """세션의 캐시 항목을 모두 제거합니다 (세션 저장소에서 세션이 삭제될 때 호출)."""
+        with self._lock:
+            for key in [key for key, entry in self._entries.items() if entry[1] == session_id]:
+                del self._entries[key]
+
+    def _message_chunks(self, session_id, source):
+        """
+        메시지를 직렬화 바이트 조각 목록으로 만듭니다.
+        저장소 참조인 첨부 항목은 저장된 JSON 바이트를 그대로 사용하고 나머지 항목만 직렬화합니다.
+        """
+        content = source["content"]
+        if not isinstance(content, list):
+            return [encode_json({"role": source["role"], "content": content})]
+        chunks = [encode_json({"role": source["role"]})[:-1] + b',"content":[']
+        for part in content:
+            if is_blob_ref(part):
+                data = self.store.get(session_id, part)
+                if data is None:
+                    # resolve_content와 같이 찾을 수 없는 항목은 제외
+                    continue
+                if not isinstance(data, bytes):
+                    data = encode_json(data)
+            else:
+                data = encode_json(part)
+            if len(chunks) > 1:
+                chunks.append(b",")
+            chunks.append(data)
+        chunks.append(b"]}")
+        return chunks
+
+    def encode_messages(self, session_id, messages, estimate, system_message=None):
+        """
+        대화 기록을 API 요청용 직렬화 바이트 조각 목록으로 만듭니다.
+        첨부 항목은 실제 값으로 되돌리지 않고 저장된 JSON 바이트를 사용하며,
+        추정 토큰 수는 캐시에 없는 메시지(보통 새 메시지)만 계산합니다.
+        대화 기록의 메시지는 추가된 뒤 바뀌지 않는다고 가정하고 객체 단위로 캐시합니다.
+
+        Args:
+            session_id (str): 세션 ID
+            messages (list): 세션 상태의 메시지 목록 (캐시 키로 사용)
+            estimate (callable): API 요청 메시지 하나의 프롬프트 토큰 수를 추정하는 함수
+            system_message (str): 맨 앞에 추가할 시스템 메시지 (매번 직렬화)
+
+        Returns:
+            EncodedMessages: 직렬화된 메시지 목록
+        """
+        encoded, prompt_tokens, last_message = [], 0, None
+        if system_message is not None:
+            message = {"role": "system", "content": system_message}
+            encoded.append([encode_json(message)])
+            prompt_tokens += estimate(message)
+            last_message = message
+
+        for index, source in enumerate(messages):
+            chunks = self._message_chunks(session_id, source)
+            tokens = self._cached_tokens(session_id, source)
+            message = None
+            if tokens is None or index == len(messages) - 1:
+                # 새 메시지(와 모델 자동 선택에 필요한 마지막 메시지)만 실제 값으로 되돌림
+                message = json.loads(b"".join(chunks))
+            if tokens is None:
+                tokens = estimate(message)
+                self._remember(session_id, source, tokens)
+            encoded.append(chunks)
+            prompt_tokens += tokens
+            if message is not None:
+                last_message = message
+
+        self._prune(session_id, messages)
+        return EncodedMessages(encoded, prompt_tokens, last_message)
+
+    def footprint(self):
+        """
+        캐시 사용량을 반환합니다.
+
+        Returns:
+            dict: 항목 수, 적중/실패 횟수
+        """
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+# 프로세스 전체에서 공유하는 직렬화 캐시
+payload_cache = PayloadCache()
+
+
+def _run_benchmark(incremental, turns, image_kb, budget):
+    """한 가지 방식으로 대화를 진행하며 턴별 (ms, 디스크 로드 수, 본문 바이트)를 측정합니다."""
+    import time
+    import uuid
+    import shutil
+    import tempfile
+
+    from modules.session_store import SessionStore, externalize_content, resolve_content
+
+    spill_dir = tempfile.mkdtemp(prefix="payload_benchmark_")
+    store = SessionStore(spill_dir=spill_dir, session_budget=budget, global_budget=budget)
+    cache = PayloadCache(store=store)
+    session_id = uuid.uuid4().hex
+    image = "data:image/png;base64," + "A" * (image_kb * 1024)
+    fields = {"model": "sonar", "temperature": 0.7, "max_tokens": 1000, "stream": True}
+    system_message = "시스템"
+    history = []
+
+    def resolve(m):
+        return {"role": m["role"], "content": resolve_content(store, session_id, m["content"])}
+
+    def estimate(m):
+        return len(encode_json(m)) // 4
+
+    results = []
+    try:
+        for turn in range(1, turns + 1):
+            content = [
+                {"type": "text", "text": f"질문 {turn}"},
+                {"type": "image_url", "image_url": {"url": image}},
+            ]
+            if incremental:
+                content = externalize_content(store, session_id, content)
+            else:
+                # 비교 기준: 첨부 항목을 값 그대로 보관하고 턴마다 전체 메시지를 직렬화하던 방식
+                content = content[:1] + [store.put(session_id, part) for part in content[1:]]
+            history.append({"role": "user", "content": content})
+            faults = store.faults
+            started_at = time.perf_counter()
+            if incremental:
+                body = cache.encode_messages(
+                    session_id, history, estimate, system_message=system_message
+                ).body(**fields)
+            else:
+                messages = [{"role": "system", "content": system_message}]
+                messages.extend(resolve(m) for m in history)
+                body = encode_json(dict(fields, messages=messages))
+            elapsed_ms = (time.perf_counter() - started_at) * 1000
+            results.append((elapsed_ms, store.faults - faults, bytes(body)))
+            history.append({"role": "assistant", "content": f"답변 {turn} " * 50})
+    finally:
+        shutil.rmtree(spill_dir, ignore_errors=True)
+    return results
+
+
+def benchmark(turns=40, image_kb=512, every=5, budget=SESSION_MEMORY_BUDGET):
+    """
+    대화가 길어질 때 턴당 요청 본문 생성 시간과 디스크 로드 수를 전체 재직렬화와 비교합니다.
+    두 방식 모두 실제 앱과 같이 첨부를 세션 저장소에 보관하고 resolve_content로 참조를 해제합니다.
+
+    Args:
+        turns (int): 대화 턴 수 (턴마다 이미지가 첨부된 사용자 메시지와 응답 추가)
+        image_kb (int): 첨부 이미지 하나의 base64 크기 (KB)
+        every (int): 결과를 출력할 턴 간격
+        budget (int): 세션 저장소 메모리 예산 (바이트)
+
+    Returns:
+        list: (턴, 전체 재직렬화 ms, 디스크 로드, 증분 생성 ms, 디스크 로드, 본문 MB) 튜플 목록
+    """
+    full = _run_benchmark(False, turns, image_kb, budget)
+    incremental = _run_benchmark(True, turns, image_kb, budget)
+    results = []
+    for turn, ((full_ms, full_faults, full_body), (inc_ms, inc_faults, inc_body)) in enumerate(
+        zip(full, incremental), 1
+    ):
+        assert full_body == inc_body
+        if turn % every == 0 or turn == 1:
+            results.append(
+                (turn, full_ms, full_faults, inc_ms, inc_faults, len(inc_body) / (1024 * 1024))
+            )
+    return results
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="턴당 요청 본문 인코딩 시간을 측정합니다.")
+    parser.add_argument("--turns", type=int, default=40, help="대화 턴 수")
+    parser.add_argument("--image-kb", type=int, default=512, help="턴마다 첨부할 이미지의 base64 크기 (KB)")
+    parser.add_argument("--every", type=int, default=5, help="출력 간격 (턴)")
+    parser.add_argument(
+        "--budget-mb", type=int, default=SESSION_MEMORY_BUDGET // (1024 * 1024),
+        help="세션 저장소 메모리 예산 (MB)"
+    )
+    args = parser.parse_args()
+
+    print(f"{'턴':>4} {'전체(ms)':>9} {'로드':>5} {'증분(ms)':>9} {'로드':>5} {'본문(MB)':>9}")
+    for turn, full_ms, full_faults, inc_ms, inc_faults, size_mb in benchmark(
+        args.turns, args.image_kb, args.every, args.budget_mb * 1024 * 1024
+    ):
+        print(f"{turn:>4} {full_ms:>9.2f} {full_faults:>5} {inc_ms:>9.2f} {inc_faults:>5} {size_mb:>9.1f}")
@@ -0,0 +1,446 @@
+"""
+세션 저장소 모듈
+첨부 파일처럼 큰 세션 데이터를 st.session_state 밖의 저장소에 보관합니다.
+세션별/전체 메모리 예산을 넘으면 오래 사용하지 않은 항목을 로컬 디스크로 내보내고(spill),
+다시 접근할 때 메모리로 불러옵니다.
+"""
+
+import os
+import re
+import json
+import stat
+import atexit
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+# 디스크로 내보낸 데이터를 저장할 디렉터리 (None이면 프로세스마다 권한 0700의 임시 디렉터리를 만들고 종료 시 삭제)
+SPILL_DIR = os.getenv("SESSION_SPILL_DIR")
+
+# 세션별 / 전체 메모리 예산 (바이트)
+SESSION_MEMORY_BUDGET = int(os.getenv("SESSION_MEMORY_BUDGET", 32 * 1024 * 1024))
+GLOBAL_MEMORY_BUDGET = int(os.getenv("GLOBAL_MEMORY_BUDGET", 512 * 1024 * 1024))
+
+# 이 시간 동안 사용하지 않은 세션은 모든 데이터를 디스크로 내보냄 (초)
+IDLE_SPILL_SECONDS = 30 * 60
+
+# 이 시간 동안 사용하지 않은 세션은 디스크 데이터까지 삭제 (초)
+IDLE_DROP_SECONDS = 24 * 60 * 60
+
+# 세션 상태에 남기는 참조의 키
+BLOB_KEY = "$blob"
+
+
+# 세션 ID 형식 (uuid4 16진수) - 디스크 경로에 사용되므로 이 형식만 허용
+SESSION_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+
+def is_valid_session_id(session_id):
+    """세션 ID가 uuid4 16진수 형식인지 확인합니다."""
+    return isinstance(session_id, str) and SESSION_ID_PATTERN.fullmatch(session_id) is not None
+
+
+def is_blob_ref(value):
+    """값이 저장소 참조인지 확인합니다."""
+    return isinstance(value, dict) and BLOB_KEY in value
+
+
+def encode_json(value):
+    """
+    값을 API 요청과 같은 형식(UTF-8, 공백 없는 JSON)으로 직렬화합니다.
+
+    Returns:
+        bytes: 직렬화된 JSON
+    """
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def _estimate_size(value):
+    """값이 차지하는 메모리 크기를 대략적으로 계산합니다."""
+    if isinstance(value, (str, bytes)):
+        return len(value)
+    return len(encode_json(value))
+
+
+# 내보낸 파일의 첫 바이트로 값의 형식을 구분 (코드를 실행할 수 있는 pickle은 사용하지 않음)
+_BYTES_TAG = b"B"
+_STR_TAG = b"S"
+_JSON_TAG = b"J"
+
+
+def _dump_value(value):
+    """값을 내보낼 파일 내용으로 직렬화합니다 (bytes, str, JSON으로 표현 가능한 값)."""
+    if isinstance(value, bytes):
+        return _BYTES_TAG + value
+    if isinstance(value, str):
+        return _STR_TAG + value.encode("utf-8")
+    return _JSON_TAG + encode_json(value)
+
+
+def _load_value(data):
+    """_dump_value로 직렬화한 파일 내용을 값으로 되돌립니다."""
+    tag, payload = data[:1], data[1:]
+    if tag == _BYTES_TAG:
+        return payload
+    if tag == _STR_TAG:
+        return payload.decode("utf-8")
+    if tag == _JSON_TAG:
+        return json.loads(payload)
+    raise ValueError("알 수 없는 형식의 내보내기 파일입니다.")
+
+
+def _private_dir(path):
+    """
+    현재 사용자만 접근할 수 있는 내보내기 디렉터리를 준비하고 경로를 반환합니다.
+    path가 None이면 새 임시 디렉터리(권한 0700)를 만들고 프로세스 종료 시 삭제합니다.
+
+    Raises:
+        PermissionError: 디렉터리가 다른 사용자의 소유이거나 다른 사용자가 쓸 수 있는 경우
+    """
+    if path is None:
+        path = tempfile.mkdtemp(prefix="perplexity_chat_spill_")
+        atexit.register(shutil.rmtree, path, ignore_errors=True)
+        return path
+
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    info = os.lstat(path)
+    if not stat.S_ISDIR(info.st_mode):
+        raise PermissionError(f"내보내기 경로가 디렉터리가 아닙니다: {path}")
+    if hasattr(os, "getuid"):
+        if info.st_uid != os.getuid():
+            raise PermissionError(f"다른 사용자 소유의 내보내기 디렉터리입니다: {path}")
+        if info.st_mode & 0o077:
+            os.chmod(path, 0o700)
+    return path
+
+
+class _Blob:
+    """저장소 항목 하나"""
+
+    __slots__ = ("session_id", "value", "size", "path")
+
+    def __init__(self, session_id, value, size):
+        self.session_id = session_id
+        self.value = value
+        self.size = size
+        # 디스크에 내보낸 파일 경로 (값은 바뀌지 않으므로 메모리로 다시 불러와도 파일을 남겨
+        # 다음에 내보낼 때 다시 쓰지 않음)
+        self.path = None
+
+
+class _SessionInfo:
+    """세션별 사용량 집계"""
+
+    __slots__ = ("memory_bytes", "disk_bytes", "blobs", "last_access")
+
+    def __init__(self):
+        self.memory_bytes = 0
+        self.disk_bytes = 0
+        self.blobs = set()
+        self.last_access = time.time()
+
+
+class SessionStore:
+    """메모리 예산과 디스크 내보내기를 지원하는 프로세스 단위 세션 데이터 저장소"""
+
+    def __init__(
+        self,
+        spill_dir=SPILL_DIR,
+        session_budget=SESSION_MEMORY_BUDGET,
+        global_budget=GLOBAL_MEMORY_BUDGET,
+    ):
+        """
+        Args:
+            spill_dir (str): 디스크로 내보낸 데이터를 저장할 디렉터리
+                (None이면 권한 0700의 임시 디렉터리, 지정하면 현재 사용자 소유여야 하며 권한을 0700으로 맞춤)
+            session_budget (int): 세션별 메모리 예산 (바이트)
+            global_budget (int): 전체 메모리 예산 (바이트)
+        """
+        self.spill_dir = _private_dir(spill_dir)
+        self.session_budget = session_budget
+        self.global_budget = global_budget
+        # 메모리에 있는 항목의 LRU 순서 (오래된 것이 앞)
+        self._lru = OrderedDict()
+        self._blobs = {}
+        self._sessions = {}
+        self._memory_bytes = 0
+        self._lock = threading.RLock()
+        # 세션이 삭제될 때 세션 ID를 인자로 호출할 함수 (세션 데이터를 참조하는 캐시 정리용)
+        self._drop_listeners = []
+        # 디스크에서 메모리로 다시 불러온 횟수
+        self.faults = 0
+
+    def _session(self, session_id):
+        info = self._sessions.get(session_id)
+        if info is None:
+            info = self._sessions[session_id] = _SessionInfo()
+        info.last_access = time.time()
+        return info
+
+    def put(self, session_id, value):
+        """
+        값을 저장하고 세션 상태에 보관할 참조를 반환합니다.
+
+        Args:
+            session_id (str): 세션 ID
+            value: 저장할 값 (bytes, str 또는 JSON으로 표현 가능한 값)
+
+        Returns:
+            dict: 저장소 참조 ({"$blob": 키})
+
+        Raises:
+            ValueError: 세션 ID 형식이 올바르지 않은 경우
+        """
+        if not is_valid_session_id(session_id):
+            raise ValueError(f"올바르지 않은 세션 ID입니다: {session_id!r}")
+        key = uuid.uuid4().hex
+        size = _estimate_size(value)
+        with self._lock:
+            info = self._session(session_id)
+            self._blobs[key] = _Blob(session_id, value, size)
+            self._lru[key] = None
+            info.blobs.add(key)
+            info.memory_bytes += size
+            self._memory_bytes += size
+            self._enforce_budgets(session_id)
+        return {BLOB_KEY: key}
+
+    def get(self, session_id, ref):
+        """
+        참조가 가리키는 값을 반환합니다. 디스크로 내보낸 값은 메모리로 다시 불러옵니다.
+
+        Args:
+            session_id (str): 세션 ID
+            ref (dict): 저장소 참조
+
+        Returns:
+            값 (없으면 None)
+        """
+        key = ref[BLOB_KEY]
+        with self._lock:
+            blob = self._blobs.get(key)
+            if blob is None or blob.session_id != session_id:
+                return None
+            info = self._session(session_id)
+
+            if key not in self._lru:
+                with open(self._checked_path(blob.path), "rb") as f:
+                    blob.value = _load_value(f.read())
+                self.faults += 1
+                info.memory_bytes += blob.size
+                self._memory_bytes += blob.size
+                self._lru[key] = None
+                value = blob.value
+                self._enforce_budgets(session_id, keep=key)
+                return value
+
+            self._lru.move_to_end(key)
+            return blob.value
+
+    def discard(self, session_id, ref):
+        """참조가 가리키는 값을 메모리와 디스크에서 삭제합니다."""
+        key = ref[BLOB_KEY]
+        with self._lock:
+            blob = self._blobs.get(key)
+            if blob is None or blob.session_id != session_id:
+                return
+            del self._blobs[key]
+            info = self._sessions[session_id]
+            info.blobs.discard(key)
+            if self._lru.pop(key, False) is not False:
+                info.memory_bytes -= blob.size
+                self._memory_bytes -= blob.size
+            if blob.path is not None:
+                info.disk_bytes -= blob.size
+                os.remove(blob.path)
+
+    def add_drop_listener(self, callback):
+        """
+        세션이 삭제될 때(drop_session, trim_idle) 호출할 함수를 등록합니다.
+
+        Args:
+            callback (callable): 세션 ID를 인자로 받는 함수
+        """
+        with self._lock:
+            self._drop_listeners.append(callback)
+
+    def drop_session(self, session_id):
+        """세션의 모든 데이터를 메모리와 디스크에서 삭제합니다."""
+        session_dir = self._session_dir(session_id)
+        with self._lock:
+            info = self._sessions.pop(session_id, None)
+            listeners = list(self._drop_listeners)
+            if info is not None:
+                for key in info.blobs:
+                    blob = self._blobs.pop(key)
+                    if self._lru.pop(key, False) is not False:
+                        self._memory_bytes -= blob.size
+        if info is not None:
+            shutil.rmtree(session_dir, ignore_errors=True)
+        for callback in listeners:
+            callback(session_id)
+
+    def trim_idle(self, spill_after=IDLE_SPILL_SECONDS, drop_after=IDLE_DROP_SECONDS):
+        """
+        오래 사용하지 않은 세션을 정리합니다.
+        spill_after가 지난 세션은 디스크로 내보내고, drop_after가 지난 세션은 삭제합니다.
+        """
+        now = time.time()
+        with self._lock:
+            sessions = list(self._sessions.items())
+        for session_id, info in sessions:
+            idle = now - info.last_access
+            if idle > drop_after:
+                self.drop_session(session_id)
+            elif idle > spill_after and info.memory_bytes:
+                with self._lock:
+                    for key in list(info.blobs):
+                        if key in self._lru:
+                            self._spill(key)
+
+    def footprint(self, session_id):
+        """
+        세션의 저장소 사용량을 반환합니다.
+
+        Returns:
+            dict: 메모리 바이트, 디스크 바이트, 항목 수
+        """
+        with self._lock:
+            info = self._sessions.get(session_id)
+            if info is None:
+                return {"memory_bytes": 0, "disk_bytes": 0, "blobs": 0}
+            return {
+                "memory_bytes": info.memory_bytes,
+                "disk_bytes": info.disk_bytes,
+                "blobs": len(info.blobs),
+            }
+
+    def global_footprint(self):
+        """
+        전체 저장소 사용량을 반환합니다.
+
+        Returns:
+            dict: 세션 수, 메모리 바이트, 디스크 바이트
+        """
+        with self._lock:
+            return {
+                "sessions": len(self._sessions),
+                "memory_bytes": self._memory_bytes,
+                "disk_bytes": sum(info.disk_bytes for info in self._sessions.values()),
+            }
+
+    def _checked_path(self, path):
+        """
+        경로가 내보내기 디렉터리 안에 있는지 확인하고 실제 경로를 반환합니다.
+
+        Raises:
+            ValueError: 경로가 내보내기 디렉터리 밖을 가리키는 경우
+        """
+        root = os.path.realpath(self.spill_dir)
+        resolved = os.path.realpath(path)
+        if os.path.commonpath([root, resolved]) != root or resolved == root:
+            raise ValueError(f"내보내기 디렉터리 밖의 경로입니다: {path}")
+        return resolved
+
+    def _session_dir(self, session_id):
+        """
+        세션의 내보내기 디렉터리 경로를 반환합니다.
+
+        Raises:
+            ValueError: 세션 ID 형식이 올바르지 않거나 경로가 내보내기 디렉터리 밖인 경우
+        """
+        if not is_valid_session_id(session_id):
+            raise ValueError(f"올바르지 않은 세션 ID입니다: {session_id!r}")
+        return self._checked_path(os.path.join(self.spill_dir, session_id))
+
+    def _spill(self, key):
+        """항목 하나를 디스크로 내보냅니다 (이미 파일이 있으면 메모리에서만 제거). (잠금을 잡은 상태에서 호출)"""
+        blob = self._blobs[key]
+        info = self._sessions[blob.session_id]
+        if blob.path is None:
+            session_dir = self._session_dir(blob.session_id)
+            os.makedirs(session_dir, mode=0o700, exist_ok=True)
+            path = os.path.join(session_dir, key)
+            # 이미 있는 파일(다른 사용자가 미리 만든 파일 등)은 덮어쓰지 않음
+            with open(path, "xb") as f:
+                f.write(_dump_value(blob.value))
+            blob.path = path
+            info.disk_bytes += blob.size
+
+        blob.value = None
+        info.memory_bytes -= blob.size
+        self._memory_bytes -= blob.size
+        del self._lru[key]
+
+    def _enforce_budgets(self, session_id, keep=None):
+        """세션 및 전체 메모리 예산을 넘으면 오래된 항목부터 디스크로 내보냅니다."""
+        info = self._sessions[session_id]
+        if info.memory_bytes > self.session_budget:
+            for key in list(self._lru):
+                if info.memory_bytes <= self.session_budget:
+                    break
+                if key != keep and self._blobs[key].session_id == session_id:
+                    self._spill(key)
+
+        if self._memory_bytes > self.global_budget:
+            for key in list(self._lru):
+                if self._memory_bytes <= self.global_budget:
+                    break
+                if key != keep:
+                    self._spill(key)
+
+
+def externalize_content(store, session_id, content):
+    """
+    메시지 content의 첨부 항목(텍스트 첨부, 이미지)을 저장소로 옮기고 참조로 바꿉니다.
+    사용자가 입력한 첫 번째 텍스트 항목은 화면 표시를 위해 그대로 둡니다.
+    첨부 항목은 API 요청 형식의 JSON 바이트로 저장하므로 요청 본문을 만들 때 다시 직렬화하지 않고
+    그대로 사용할 수 있습니다 (저장소에는 이 한 벌만 보관).
+
+    Args:
+        store (SessionStore): 세션 저장소
+        session_id (str): 세션 ID
+        content (str | list): 메시지 content
+
+    Returns:
+        str | list: 첨부 항목이 참조로 바뀐 content
+    """
+    if not isinstance(content, list):
+        return content
+    return content[:1] + [
+        part if is_blob_ref(part) else store.put(session_id, encode_json(part))
+        for part in content[1:]
+    ]
+
+
+def resolve_content(store, session_id, content):
+    """
+    content에 포함된 저장소 참조를 실제 값으로 바꿉니다. 찾을 수 없는 항목은 제외합니다.
+
+    Args:
+        store (SessionStore): 세션 저장소
+        session_id (str): 세션 ID
+        content (str | list): 메시지 content
+
+    Returns:
+        str | list: 참조가 해제된 content
+    """
+    if not isinstance(content, list):
+        return content
+    resolved = []
+    for part in content:
+        if is_blob_ref(part):
+            part = store.get(session_id, part)
+            if part is None:
+                continue
+            if isinstance(part, bytes):
+                part = json.loads(part)
+        resolved.append(part)
+    return resolved
+
+
+# 프로세스 전체에서 공유하는 세션 저장소
+session_store = SessionStore()
@@ -3,8 +3,23 @@ UI 컴포넌트 모듈
 Streamlit UI 컴포넌트 및 레이아웃 관련 기능을 제공합니다.
 """
 
+import json
+import time
+import uuid
 import streamlit as st
-from modules.file_processor import process_file, save_conversation, load_conversation
+from modules.file_processor import save_conversation, load_conversation
+from modules.ingestion import ingest_files
+from modules.hedging import hedge_stats
+from modules.api_client import CANCEL_POLL_INTERVAL
+from modules.generation_jobs import job_manager
+from modules.session_store import (
+    session_store, externalize_content, resolve_content, is_valid_session_id
+)
+from modules.usage_ledger import usage_ledger, estimate_prompt_tokens, DAILY_TOKEN_BUDGET
+from modules.async_jobs import async_job_store, POLL_INTERVAL
+from modules.payload_builder import payload_cache
+from modules.model_registry import DEFAULT_MODEL, model_names, model_stats
+from modules.model_router import AUTO_MODEL
 
 def setup_page():
     """
@@ -21,6 +36,17 @@ def initialize_session_state():
     """
     세션 상태를 초기화합니다.
     """
+    if "session_id" not in st.session_state:
+        # 새로고침 후에도 비동기 작업 결과 등을 이어받을 수 있도록 URL의 세션 ID를 사용
+        # (세션 ID는 디스크 경로에 쓰이므로 형식이 맞지 않으면 새로 발급)
+        # 주의: URL의 sid는 세션 데이터, 비동기 결과, 사용량에 접근하는 토큰 역할을 하므로 공유하지 않아야 함
+        sid = st.query_params.get("sid")
+        st.session_state.session_id = sid if is_valid_session_id(sid) else uuid.uuid4().hex
+    st.query_params["sid"] = st.session_state.session_id
+
+    # 오래 사용하지 않은 세션의 데이터를 디스크로 내보내거나 삭제
+    session_store.trim_idle()
+
     if "messages" not in st.session_state:
         st.session_state.messages = []
     if "metadata_history" not in st.session_state:
@@ -35,12 +61,20 @@ def initialize_session_state():
     if "generating" not in st.session_state:
         st.session_state.generating = False
 
-    if "cancel_generation" not in st.session_state:
-        st.session_state.cancel_generation = False
+    if "active_job_id" not in st.session_state:
+        st.session_state.active_job_id = None
+
+    # 실패한 생성 작업의 오류 (재실행 후 다음 화면에 표시)
+    if "generation_error" not in st.session_state:
+        st.session_state.generation_error = None
 
     if "uploaded_files" not in st.session_state:
         st.session_state.uploaded_files = {}
 
+    # 크기/형식 오류나 중복으로 건너뛴 업로드 파일 ID
+    if "skipped_uploads" not in st.session_state:
+        st.session_state.skipped_uploads = set()
+
 
 def render_sidebar():
     """
@@ -52,21 +86,28 @@ def render_sidebar():
     with st.sidebar:
         st.title("설정")
 
-        # 모델 선택
-        models = [
-            "sonar-deep-research",
-            "sonar-reasoning-pro",
-            "sonar-reasoning",
-            "sonar-pro",
-            "sonar"
-        ]
+        # 모델 선택 (자동 선택 시 요청마다 적합하면서 가장 빠른 모델 사용)
+        models = [AUTO_MODEL] + model_names()
 
         model = st.selectbox(
             "모델 선택",
             options=models,
-            index=4,  # sonar를 기본값으로 설정
+            index=models.index(DEFAULT_MODEL),  # sonar를 기본값으로 설정
+            format_func=lambda m: "자동 선택 (auto)" if m == AUTO_MODEL else m,
+            help="자동 선택은 프롬프트 특징, 첨부 파일, 관측된 p95 첫 토큰 도착 시간으로 요청마다 모델을 고릅니다."
         )
         st.session_state.model = model
+        render_model_stats()
+
+        # 심층 연구 모델은 비동기 작업으로 실행 가능
+        use_async = False
+        if model in (AUTO_MODEL, "sonar-deep-research"):
+            use_async = st.checkbox(
+                "비동기 실행" if model != AUTO_MODEL else "심층 연구 모델 선택 시 비동기 실행",
+                value=st.session_state.get("use_async", True),
+                help="요청을 작업 테이블에 기록하고 백그라운드에서 결과를 조회합니다. 페이지를 떠나거나 서버가 재시작되어도 완료되면 대화에 전달됩니다."
+            )
+            st.session_state.use_async = use_async
 
         # 온도 설정
         temperature = st.slider(
@@ -85,9 +126,12 @@ def render_sidebar():
             max_value=4000,
             value=1000,
             step=100,
-            help="응답의 최대 길이를 설정합니다."
+            help="응답의 최대 길이를 설정합니다. 요청 시 남은 예산과 모델별로 관측된 응답 길이에 맞춰 자동으로 줄어들 수 있습니다."
         )
 
+        # 사용량 표시
+        render_usage_summary()
+
         # 시스템 메시지 설정
         system_message = st.text_area(
             "시스템 메시지",
@@ -96,6 +140,20 @@ def render_sidebar():
         )
         st.session_state.system_message = system_message
 
+        # 요청 헤징 설정
+        hedge = st.checkbox(
+            "요청 헤징 (실험적)",
+            value=st.session_state.get("hedge", False),
+            help="첫 토큰이 최근 p95 시간 안에 오지 않으면 동일한 요청을 한 번 더 보내고 먼저 응답한 쪽을 사용합니다. 비용이 늘어날 수 있습니다."
+        )
+        st.session_state.hedge = hedge
+        if hedge:
+            stats = hedge_stats.summary()
+            st.caption(
+                f"헤징률 {stats['hedge_rate']:.0%} ({stats['hedged']}/{stats['requests']}), "
+                f"헤지 승리 {stats['hedge_wins']}회, 절감 {stats['saved_seconds']:.1f}초"
+            )
+
         # MCP 서버 설정
         # render_mcp_settings()
 
@@ -103,7 +161,15 @@ def render_sidebar():
         render_conversation_management()
 
         # 대화 초기화 버튼
+        # 세션 저장소 사용량 표시
+        footprint = session_store.footprint(st.session_state.session_id)
+        st.caption(
+            f"세션 데이터: 메모리 {footprint['memory_bytes'] / 1024 / 1024:.1f} MB, "
+            f"디스크 {footprint['disk_bytes'] / 1024 / 1024:.1f} MB ({footprint['blobs']}개 항목)"
+        )
+
         if st.button("대화 초기화"):
+            session_store.drop_session(st.session_state.session_id)
             st.session_state.messages = []
             st.session_state.uploaded_files = {}
             st.session_state.metadata_history = []
@@ -113,10 +179,25 @@ def render_sidebar():
         "model": model,
         "temperature": temperature,
         "max_tokens": max_tokens,
-        "system_message": system_message
+        "system_message": system_message,
+        "hedge": hedge,
+        "use_async": use_async
     }
 
 
+def render_usage_summary():
+    """사용량 원장의 오늘/세션 사용량을 표시합니다."""
+    import datetime
+
+    today = usage_ledger.totals(day=datetime.date.today().isoformat())
+    session = usage_ledger.totals(session_id=st.session_state.session_id)
+    budget = f" / 예산 {DAILY_TOKEN_BUDGET:,}" if DAILY_TOKEN_BUDGET else ""
+    st.caption(
+        f"오늘 사용량: {today['total_tokens']:,} 토큰{budget} ({today['requests']}회), "
+        f"이 세션: {session['total_tokens']:,} 토큰"
+    )
+
+
 def render_mcp_settings():
     """MCP 서버 설정 UI를 렌더링합니다."""
     st.subheader("MCP 서버 설정")
@@ -163,7 +244,7 @@ def render_conversation_management():
         if st.session_state.messages:
             filename = save_conversation(
                 save_filename,
-                st.session_state.messages,
+                resolve_messages(st.session_state.messages),
                 st.session_state.get("model", "sonar"),
                 st.session_state.get("system_message", "You are a helpful AI assistant.")
             )
@@ -177,7 +258,15 @@ def render_conversation_management():
         if st.button("불러오기"):
             success, result = load_conversation(uploaded_file)
             if success:
-                st.session_state.messages = result["messages"]
+                st.session_state.messages = [
+                    {
+                        **msg,
+                        "content": externalize_content(
+                            session_store, st.session_state.session_id, msg["content"]
+                        ),
+                    }
+                    for msg in result["messages"]
+                ]
 
                 # 시스템 메시지가 있으면 업데이트
                 if "system_message" in result:
@@ -189,19 +278,40 @@ def render_conversation_management():
                 st.error(result)
 
 
+def render_model_stats():
+    """모델별 첫 토큰 도착 시간과 사용량/비용 통계를 표시합니다."""
+    with st.expander("모델 통계", expanded=False):
+        for name in model_names():
+            stats = model_stats(name)
+            if stats["ttft_source"] == "observed":
+                ttft = f"첫 토큰 p95 {stats['ttft_p95']:.1f}초 ({stats['ttft_samples']}회 관측)"
+            else:
+                ttft = f"첫 토큰 약 {stats['ttft_p95']:.1f}초 (사전값)"
+            usage = ""
+            if stats["requests"]:
+                usage = f", 요청 {stats['requests']}회, 평균 {stats['avg_tokens']:.0f} 토큰"
+                if stats["avg_cost"] is not None:
+                    usage += f", 요청당 약 ${stats['avg_cost']:.4f}"
+            st.caption(f"**{name}**: {ttft}{usage}")
+
+
 def render_file_upload_section():
     """파일 업로드 섹션을 렌더링합니다."""
-    uploaded_files = st.file_uploader("이미지 파일 업로드 (선택사항, < 5MB)", type=["png", "jpg", "jpeg", "webp", "gif"], accept_multiple_files=True, key="file_upload")
+    uploaded_files = st.file_uploader(
+        "파일 업로드 (이미지/텍스트 < 5MB, JSON < 50MB, 선택사항)",
+        type=["png", "jpg", "jpeg", "webp", "gif", "txt", "json"],
+        accept_multiple_files=True,
+        key="file_upload",
+    )
     if uploaded_files:
-        for uploaded_file in uploaded_files:
-            if uploaded_file.name not in st.session_state.uploaded_files:
-                # 파일 처리 및 저장
-                result, file_info = process_file(uploaded_file)
-                if result:
-                    st.session_state.uploaded_files[uploaded_file.name] = file_info
-                    st.info(f"파일이 업로드되었습니다: {uploaded_file.name} ({file_info['summary']})")
-                else:
-                    st.error(f"파일 업로드 실패: {uploaded_file.name}, {file_info}")
+        # 이미 추가했거나 건너뛴 파일은 재실행 때마다 다시 처리하지 않음
+        new_files = [
+            f for f in uploaded_files
+            if f.name not in st.session_state.uploaded_files
+            and getattr(f, "file_id", f.name) not in st.session_state.skipped_uploads
+        ]
+        if new_files:
+            ingest_uploaded_files(new_files)
 
     # 업로드된 파일 목록 표시
     if st.session_state.uploaded_files:
@@ -212,10 +322,151 @@ def render_file_upload_section():
             with cols[col_idx]:
                 st.text(f"{filename}: {file_info['summary']}")
                 if st.button("삭제", key=f"delete_file_{i}"):
+                    session_store.discard(st.session_state.session_id, file_info["content"])
                     del st.session_state.uploaded_files[filename]
                     st.rerun()
 
 
+def ingest_uploaded_files(files):
+    """
+    새로 업로드된 파일을 병렬로 처리하여 세션에 추가하고 진행률과 파일별 처리 시간을 표시합니다.
+
+    Args:
+        files (list): 처리할 업로드 파일 목록
+    """
+    known_hashes = {
+        file_info["hash"]: filename
+        for filename, file_info in st.session_state.uploaded_files.items()
+        if file_info.get("hash")
+    }
+    progress = st.progress(0.0, text=f"파일 처리 중... (0/{len(files)})")
+
+    def on_progress(done, total, result):
+        progress.progress(done / total, text=f"파일 처리 중... ({done}/{total}) {result['name']}")
+
+    started_at = time.perf_counter()
+    results = ingest_files(files, known_hashes, on_progress=on_progress)
+    elapsed = time.perf_counter() - started_at
+    progress.empty()
+
+    for file, result in zip(files, results):
+        timing = f"{result['seconds']:.2f}초"
+        if result["status"] == "ok":
+            file_info = result["info"]
+            # 파일 내용은 세션 저장소에 보관하고 참조만 세션 상태에 저장
+            file_info["content"] = session_store.put(
+                st.session_state.session_id, file_info["content"]
+            )
+            st.session_state.uploaded_files[result["name"]] = file_info
+            st.info(f"파일이 업로드되었습니다: {result['name']} ({file_info['summary']}, {timing})")
+            continue
+
+        st.session_state.skipped_uploads.add(getattr(file, "file_id", file.name))
+        if result["status"] == "duplicate":
+            st.warning(f"이미 업로드된 파일이라 건너뜁니다: {result['name']} ({result['error']})")
+        else:
+            st.error(f"파일 업로드 실패: {result['name']}, {result['error']} ({timing})")
+
+    if len(files) > 1:
+        st.caption(f"{len(files)}개 파일 처리 완료 (총 {elapsed:.2f}초)")
+
+
+def resolve_uploaded_files():
+    """
+    업로드된 파일 정보를 세션 저장소에서 불러와 실제 내용이 담긴 딕셔너리로 반환합니다.
+
+    Returns:
+        dict: 파일명 -> 파일 정보
+    """
+    files = {}
+    for filename, file_info in st.session_state.uploaded_files.items():
+        content = session_store.get(st.session_state.session_id, file_info["content"])
+        if content is not None:
+            files[filename] = {**file_info, "content": content}
+    return files
+
+
+def resolve_messages(messages):
+    """
+    메시지 목록의 세션 저장소 참조를 실제 값으로 바꾼 복사본을 반환합니다.
+
+    Args:
+        messages (list): 세션 상태의 메시지 목록
+
+    Returns:
+        list: API 요청이나 저장에 사용할 메시지 목록
+    """
+    return [
+        {
+            "role": m["role"],
+            "content": resolve_content(session_store, st.session_state.session_id, m["content"]),
+        }
+        for m in messages
+    ]
+
+
+def build_request_messages(system_message):
+    """
+    시스템 메시지와 대화 기록으로 API 요청 메시지 목록을 만듭니다.
+    지난 메시지의 직렬화 바이트는 캐시를 재사용하므로 새 메시지만 직렬화합니다.
+
+    Args:
+        system_message (str): 시스템 메시지
+
+    Returns:
+        EncodedMessages: API 요청 메시지 목록
+    """
+    session_id = st.session_state.session_id
+    return payload_cache.encode_messages(
+        session_id,
+        st.session_state.messages,
+        lambda m: estimate_prompt_tokens([m]),
+        system_message=system_message,
+    )
+
+
+def store_message_content(content):
+    """
+    메시지 content의 첨부 항목을 세션 저장소로 옮기고 참조로 바꾼 content를 반환합니다.
+    """
+    return externalize_content(session_store, st.session_state.session_id, content)
+
+
+def deliver_async_results():
+    """
+    완료된 비동기 작업의 결과를 대화 기록에 반영합니다.
+    작업이 진행되는 동안 채팅 입력을 막으므로 결과는 항상 작업을 요청한 질문 바로 뒤에 추가됩니다.
+    """
+    from modules.api_client import metadata_from_completion
+
+    for job in async_job_store.undelivered(st.session_state.session_id):
+        if job["status"] == "completed":
+            full_response, metadata = metadata_from_completion(json.loads(job["result"]))
+            # 제출할 때 저장한 메타데이터(자동 모델 선택 결과 등)를 합침
+            if job["metadata"]:
+                metadata.update(json.loads(job["metadata"]))
+            metadata["async_job_id"] = job["id"]
+            st.session_state.messages.append({"role": "assistant", "content": full_response})
+            st.session_state.metadata_history.append(metadata)
+        else:
+            st.error(f"비동기 작업이 실패했습니다 ({job['id']}): {job['error']}")
+            # 작업이 진행되는 동안 입력을 막으므로 마지막 메시지가 답변 없는 질문이면 제거
+            if st.session_state.messages and st.session_state.messages[-1]["role"] == "user":
+                st.session_state.messages.pop()
+        async_job_store.mark_delivered(job["id"])
+
+
+@st.fragment(run_every=POLL_INTERVAL)
+def render_async_job_status():
+    """진행 중인 비동기 작업 수를 표시하고, 완료된 작업이 있으면 앱을 다시 실행합니다."""
+    session_id = st.session_state.session_id
+    if async_job_store.undelivered(session_id):
+        st.rerun()
+    pending = async_job_store.pending(session_id)
+    if pending:
+        st.info(f"진행 중인 비동기 작업 {len(pending)}개 — 완료되면 대화에 자동으로 추가됩니다.")
+
+
 def render_chat_history():
     """채팅 기록을 렌더링합니다."""
     from modules.api_client import display_metadata
@@ -233,9 +484,127 @@ def render_chat_history():
                 assistant_idx += 1
 
 
+def cancel_current_generation():
+    """진행 중인 응답 생성을 취소하고 업스트림 연결을 즉시 닫습니다."""
+    job_manager.cancel(st.session_state.get("active_job_id"))
+
+
+def get_active_job():
+    """
+    현재 세션에 연결된 생성 작업을 반환합니다.
+    세션 상태에 없으면 URL 쿼리 파라미터의 작업 ID로 재연결하고,
+    새 세션이라면 작업 시작 시점의 대화 기록과 응답별 메타데이터를 복원합니다.
+
+    Returns:
+        GenerationJob | None: 진행 중이거나 아직 반영되지 않은 작업
+    """
+    job_id = st.session_state.active_job_id or st.query_params.get("job")
+    job = job_manager.get(job_id)
+
+    if job is None:
+        # 만료되었거나 서버가 재시작된 작업
+        st.session_state.active_job_id = None
+        st.query_params.pop("job", None)
+    elif st.session_state.active_job_id != job.id:
+        st.session_state.active_job_id = job.id
+        if not st.session_state.messages:
+            st.session_state.messages = list(job.conversation)
+            # 응답별 메타데이터도 함께 복원해야 대화 기록의 응답과 순서가 맞음
+            st.session_state.metadata_history = list(job.metadata_history)
+            # 대화 기록의 저장소 참조를 해제할 수 있도록 작업을 시작한 세션 ID를 이어받음
+            if job.session_id:
+                st.session_state.session_id = job.session_id
+
+    st.session_state.generating = job is not None
+    return job
+
+
+def start_generation_job(start_stream, on_complete=None):
+    """
+    응답 생성 작업을 백그라운드 워커에 제출하고 현재 세션에 연결합니다.
+
+    Args:
+        start_stream (callable): 워커 스레드에서 응답 스트림을 생성하는 함수
+        on_complete (callable): 응답이 끝났을 때 메타데이터를 인자로 호출할 함수
+
+    Returns:
+        GenerationJob: 제출된 작업
+    """
+    job = job_manager.submit(
+        start_stream,
+        conversation=list(st.session_state.messages),
+        session_id=st.session_state.session_id,
+        on_complete=on_complete,
+        metadata_history=list(st.session_state.metadata_history),
+    )
+    st.session_state.active_job_id = job.id
+    st.session_state.generating = True
+    # 새로고침 후에도 재연결할 수 있도록 URL에 작업 ID 기록
+    st.query_params["job"] = job.id
+    return job
+
+
+def attach_generation_job(job):
+    """
+    생성 작업에 연결하여 지금까지의 델타를 재생하고, 완료될 때까지 스트리밍으로 표시합니다.
+    스크립트는 짧은 주기로 UI를 갱신하므로 재실행되면 즉시 중단되며, 작업은 계속 진행됩니다.
+
+    Args:
+        job (GenerationJob): 연결할 작업
+
+    Returns:
+        bool: 응답을 대화 기록에 반영했는지 여부 (실패하거나 빈 응답으로 취소되면 False)
+    """
+    from modules.api_client import display_metadata
+
+    with st.chat_message("assistant"):
+        message_placeholder = st.empty()
+        offset = 0
+        full_response = ""
+        with st.spinner("생각 중..."):
+            while True:
+                deltas, finished = job.wait_deltas(offset, CANCEL_POLL_INTERVAL)
+                offset += len(deltas)
+                full_response += "".join(deltas)
+                if finished:
+                    break
+                message_placeholder.write(full_response + "▌")
+
+        message_placeholder.write(full_response)
+        if job.status != "error" and job.metadata:
+            display_metadata(job.metadata)
+
+    if job.status == "error":
+        # 호출한 쪽이 곧바로 재실행하므로 오류는 세션 상태에 저장해 다음 화면에서 표시
+        st.session_state.generation_error = f"오류가 발생했습니다: {job.error}"
+        full_response = ""
+
+    # AI 응답을 세션 상태에 저장
+    reflected = bool(full_response)  # 취소된 경우 빈 응답이 될 수 있음
+    if reflected:
+        st.session_state.messages.append({"role": "assistant", "content": full_response})
+        st.session_state.metadata_history.append(job.metadata or {})
+    elif st.session_state.messages and st.session_state.messages[-1]["role"] == "user":
+        # 답변 없는 사용자 메시지가 남으면 다음 요청에서 user/assistant 순서가 어긋나므로 제거
+        st.session_state.messages.pop()
+
+    # 생성 상태 해제
+    st.session_state.active_job_id = None
+    st.session_state.generating = False
+    st.query_params.pop("job", None)
+    return reflected
+
+
+def render_generation_error():
+    """직전 생성 작업이 실패했으면 오류를 한 번 표시합니다."""
+    error = st.session_state.generation_error
+    if error:
+        st.error(error)
+        st.session_state.generation_error = None
+
+
 def render_cancel_button():
     """응답 생성 취소 버튼을 렌더링합니다."""
     if st.session_state.generating:
-        if st.button("응답 생성 취소", key="cancel_button"):
-            st.session_state.cancel_generation = True
+        if st.button("응답 생성 취소", key="cancel_button", on_click=cancel_current_generation):
             st.info("응답 생성을 취소하는 중...")
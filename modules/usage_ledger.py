@@ -0,0 +1,291 @@
+"""
+사용량 원장 모듈
+응답별 토큰 사용량을 SQLite에 기록하여 모델/세션/일자별로 집계하고,
+요청 전에 프롬프트 크기를 추정해 남은 예산과 관측된 응답 길이에 맞춰 max_tokens를 조정합니다.
+"""
+
+import os
+import sqlite3
+import threading
+import datetime
+from contextlib import contextmanager
+
+from modules.api_client import estimate_tokens
+from modules.model_registry import context_window as model_context_window
+from modules.payload_builder import EncodedMessages
+
+# 원장 데이터베이스 경로
+LEDGER_PATH = os.getenv("USAGE_LEDGER_PATH", "usage_ledger.sqlite3")
+
+# 하루 토큰 예산 (0이면 제한 없음)
+DAILY_TOKEN_BUDGET = int(os.getenv("DAILY_TOKEN_BUDGET", 0))
+
+# 이미지 한 장의 추정 토큰 수와 메시지당 오버헤드
+IMAGE_TOKEN_ESTIMATE = 1000
+MESSAGE_TOKEN_OVERHEAD = 4
+
+# 관측된 응답 길이로 max_tokens를 줄이기 위해 필요한 최소 표본 수와 여유 배수
+MIN_COMPLETION_SAMPLES = 20
+COMPLETION_HEADROOM = 1.5
+MIN_MAX_TOKENS = 256
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS usage (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created_at TEXT NOT NULL,
+    day TEXT NOT NULL,
+    session_id TEXT,
+    model TEXT NOT NULL,
+    prompt_tokens INTEGER NOT NULL,
+    completion_tokens INTEGER NOT NULL,
+    total_tokens INTEGER NOT NULL,
+    max_tokens INTEGER,
+    cancelled INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS usage_day_model ON usage (day, model);
+CREATE INDEX IF NOT EXISTS usage_session ON usage (session_id);
+"""
+
+
+def _usage_field(usage, field):
+    """사용량 객체(OpenAI 객체 또는 dict)에서 정수 필드를 읽습니다 (없거나 추정 불가면 0)."""
+    if usage is None:
+        return 0
+    value = getattr(usage, field, None) if not isinstance(usage, dict) else usage.get(field)
+    return value if isinstance(value, int) else 0
+
+
+def shared_usage_source(usage):
+    """
+    게이트웨이가 다른 요청의 응답을 재사용한 경우 그 출처("coalesced" | "cache")를 반환합니다.
+
+    Returns:
+        str | None: 업스트림을 직접 호출한 응답이면 None
+    """
+    if not isinstance(usage, dict):
+        return None
+    source = usage.get("gateway_source")
+    return source if source not in (None, "upstream") else None
+
+
+class UsageLedger:
+    """토큰 사용량을 기록하고 집계하는 SQLite 기반 원장"""
+
+    def __init__(self, path=LEDGER_PATH):
+        """
+        Args:
+            path (str): SQLite 데이터베이스 파일 경로
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        with self._connect() as conn:
+            conn.executescript(_SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        """트랜잭션을 커밋하고 연결을 닫는 컨텍스트를 반환합니다."""
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def record(
+        self, session_id, model, usage, max_tokens=None, cancelled=False, prompt_estimate=0
+    ):
+        """
+        응답 하나의 사용량을 기록합니다.
+
+        Args:
+            session_id (str): 세션 ID
+            model (str): 모델 이름
+            usage: 응답 메타데이터의 usage (OpenAI 객체 또는 dict)
+            max_tokens (int): 요청에 사용한 max_tokens
+            cancelled (bool): 취소되어 부분 사용량인지 여부
+            prompt_estimate (int): usage에 프롬프트 토큰이 없을 때 사용할 추정값
+        """
+        # 게이트웨이가 병합/캐시로 재사용한 응답은 원래 요청에서 이미 기록되었으므로 건너뜀
+        if shared_usage_source(usage) is not None:
+            return
+
+        prompt_tokens = _usage_field(usage, "prompt_tokens") or prompt_estimate
+        completion_tokens = _usage_field(usage, "completion_tokens")
+        total_tokens = _usage_field(usage, "total_tokens") or prompt_tokens + completion_tokens
+        now = datetime.datetime.now()
+
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                "INSERT INTO usage (created_at, day, session_id, model, prompt_tokens,"
+                " completion_tokens, total_tokens, max_tokens, cancelled)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    now.isoformat(timespec="seconds"),
+                    now.date().isoformat(),
+                    session_id,
+                    model,
+                    prompt_tokens,
+                    completion_tokens,
+                    total_tokens,
+                    max_tokens,
+                    int(cancelled),
+                ),
+            )
+
+    def totals(self, day=None, session_id=None, model=None):
+        """
+        조건에 맞는 사용량 합계를 반환합니다.
+
+        Args:
+            day (str): 일자 (YYYY-MM-DD)
+            session_id (str): 세션 ID
+            model (str): 모델 이름
+
+        Returns:
+            dict: 요청 수, 프롬프트/완성/총 토큰 합계
+        """
+        conditions, params = [], []
+        for column, value in (("day", day), ("session_id", session_id), ("model", model)):
+            if value is not None:
+                conditions.append(f"{column} = ?")
+                params.append(value)
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(prompt_tokens), 0),"
+                " COALESCE(SUM(completion_tokens), 0), COALESCE(SUM(total_tokens), 0)"
+                f" FROM usage{where}",
+                params,
+            ).fetchone()
+        return {
+            "requests": row[0],
+            "prompt_tokens": row[1],
+            "completion_tokens": row[2],
+            "total_tokens": row[3],
+        }
+
+    def by_model(self, day=None):
+        """
+        모델별 사용량 합계를 반환합니다.
+
+        Args:
+            day (str): 일자 (YYYY-MM-DD, None이면 전체 기간)
+
+        Returns:
+            list: (모델, 요청 수, 총 토큰) 튜플 목록
+        """
+        where, params = ("WHERE day = ?", [day]) if day else ("", [])
+        with self._connect() as conn:
+            return conn.execute(
+                f"SELECT model, COUNT(*), SUM(total_tokens) FROM usage {where}"
+                " GROUP BY model ORDER BY SUM(total_tokens) DESC",
+                params,
+            ).fetchall()
+
+    def completion_percentile(self, model, q=95, limit=200):
+        """
+        모델의 최근 완료된 응답 길이(완성 토큰)의 백분위수를 반환합니다.
+
+        Args:
+            model (str): 모델 이름
+            q (float): 백분위 (0~100)
+            limit (int): 사용할 최근 표본 수
+
+        Returns:
+            int | None: 백분위수 (표본이 MIN_COMPLETION_SAMPLES보다 적으면 None)
+        """
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT completion_tokens FROM usage"
+                " WHERE model = ? AND cancelled = 0 AND completion_tokens > 0"
+                " ORDER BY id DESC LIMIT ?",
+                (model, limit),
+            ).fetchall()
+        if len(rows) < MIN_COMPLETION_SAMPLES:
+            return None
+        values = sorted(row[0] for row in rows)
+        rank = max(1, -(-len(values) * q // 100))
+        return values[int(rank) - 1]
+
+
+def estimate_prompt_tokens(messages):
+    """
+    요청 메시지 목록의 프롬프트 토큰 수를 추정합니다.
+
+    Args:
+        messages (list | EncodedMessages): API 요청에 사용할 메시지 목록
+            (EncodedMessages면 메시지별로 캐시된 추정값의 합)
+
+    Returns:
+        int: 추정 토큰 수
+    """
+    if isinstance(messages, EncodedMessages):
+        return messages.prompt_tokens
+    total = 0
+    for message in messages:
+        total += MESSAGE_TOKEN_OVERHEAD
+        content = message.get("content")
+        if isinstance(content, str):
+            total += estimate_tokens(content)
+            continue
+        for part in content or []:
+            if part.get("type") == "image_url":
+                total += IMAGE_TOKEN_ESTIMATE
+            else:
+                total += estimate_tokens(part.get("text") or part.get("content") or "")
+    return total
+
+
+def plan_max_tokens(model, messages, requested, ledger=None, daily_budget=DAILY_TOKEN_BUDGET):
+    """
+    요청 전에 프롬프트 크기를 추정하고 max_tokens를 조정합니다.
+    컨텍스트 윈도우, 오늘 남은 토큰 예산, 관측된 응답 길이 중 가장 작은 값으로 제한합니다.
+
+    Args:
+        model (str): 모델 이름
+        messages (list): API 요청에 사용할 메시지 목록
+        requested (int): 사용자가 설정한 max_tokens
+        ledger (UsageLedger): 사용량 원장 (None이면 공유 원장 사용)
+        daily_budget (int): 하루 토큰 예산 (0이면 제한 없음)
+
+    Returns:
+        dict: 조정 결과 (prompt_tokens_estimate, requested, max_tokens, limited_by)
+
+    Raises:
+        ValueError: 프롬프트가 컨텍스트 윈도우를 넘거나 예산이 소진된 경우
+    """
+    ledger = ledger or usage_ledger
+    prompt_tokens = estimate_prompt_tokens(messages)
+    limits = {"requested": requested}
+
+    context_window = model_context_window(model)
+    limits["context_window"] = context_window - prompt_tokens
+    if limits["context_window"] <= 0:
+        raise ValueError(
+            f"프롬프트가 너무 깁니다 (추정 {prompt_tokens} 토큰, {model} 컨텍스트 {context_window} 토큰)."
+        )
+
+    if daily_budget:
+        used = ledger.totals(day=datetime.date.today().isoformat())["total_tokens"]
+        limits["daily_budget"] = daily_budget - used - prompt_tokens
+        if limits["daily_budget"] <= 0:
+            raise ValueError(
+                f"오늘의 토큰 예산이 부족합니다 (사용 {used} / 예산 {daily_budget}, 프롬프트 추정 {prompt_tokens})."
+            )
+
+    observed = ledger.completion_percentile(model)
+    if observed is not None:
+        limits["observed_completion"] = max(MIN_MAX_TOKENS, int(observed * COMPLETION_HEADROOM))
+
+    max_tokens = min(limits.values())
+    return {
+        "prompt_tokens_estimate": prompt_tokens,
+        "requested": requested,
+        "max_tokens": max_tokens,
+        "limited_by": [name for name, value in limits.items() if value == max_tokens and name != "requested"],
+    }
+
+
+# 프로세스 전체에서 공유하는 사용량 원장
+usage_ledger = UsageLedger()
@@ -8,11 +8,18 @@ import streamlit as st
 from dotenv import load_dotenv
 
 # 모듈 임포트
-from modules.api_client import PerplexityClient, process_stream_response, display_metadata
+from modules.api_client import PerplexityClient
+from modules.cassette import transport_from_env
 from modules.file_processor import create_file_attachment_message
+from modules.usage_ledger import usage_ledger, plan_max_tokens
+from modules.async_jobs import async_job_store, ensure_poller, submit_async_job
+from modules.model_router import AUTO_MODEL, route_model, describe_routing
 from modules.ui_components import (
     setup_page, initialize_session_state, render_sidebar,
-    render_file_upload_section, render_chat_history, render_cancel_button
+    render_file_upload_section, render_chat_history, render_cancel_button,
+    get_active_job, start_generation_job, attach_generation_job,
+    resolve_uploaded_files, build_request_messages, store_message_content,
+    deliver_async_results, render_async_job_status, render_generation_error
 )
 
 # 환경 변수 로드
@@ -24,8 +31,29 @@ if not api_key:
     st.error("API 키가 설정되지 않았습니다. .env 파일에 PERPLEXITY_API_KEY를 설정해주세요.")
     st.stop()
 
+
+@st.cache_resource
+def get_perplexity_client(api_key, base_url):
+    """
+    프로세스 단위로 한 번만 Perplexity API 클라이언트를 생성합니다.
+    재실행마다 새로 만들면 연결 풀이 닫히지 않고 쌓이며, 카세트 재생 순서도 처음으로 돌아갑니다.
+
+    Args:
+        api_key (str): Perplexity API 키
+        base_url (str): API 주소 (None이면 Perplexity API)
+
+    Returns:
+        PerplexityClient: 모든 세션이 공유하는 클라이언트
+    """
+    # 환경 변수에 따라 카세트 녹화/재생, PERPLEXITY_BASE_URL로 게이트웨이 사용
+    return PerplexityClient(api_key, transport=transport_from_env(), base_url=base_url)
+
+
 # Perplexity API 클라이언트 초기화
-perplexity_client = PerplexityClient(api_key)
+perplexity_client = get_perplexity_client(api_key, os.getenv("PERPLEXITY_BASE_URL"))
+
+# 비동기 작업 폴러 시작 (재시작 전에 제출된 미완료 작업도 이어서 조회)
+ensure_poller(perplexity_client, async_job_store)
 
 # 페이지 설정
 setup_page()
@@ -33,12 +61,17 @@ setup_page()
 # 세션 상태 초기화
 initialize_session_state()
 
+# 진행 중인 생성 작업 확인 (새로고침 후에는 URL의 작업 ID로 재연결)
+active_job = get_active_job()
+
 # 사이드바 렌더링
 settings = render_sidebar()
 model = settings["model"]
 temperature = settings["temperature"]
 max_tokens = settings["max_tokens"]
 system_message = settings["system_message"]
+hedge = settings["hedge"]
+use_async = settings["use_async"]
 
 # 메인 화면 제목
 st.title("Perplexity AI 챗봇 🤖")
@@ -46,87 +79,111 @@ st.title("Perplexity AI 챗봇 🤖")
 # 파일 업로드 섹션 렌더링
 render_file_upload_section()
 
-# 채팅 기록 렌더링
+# 완료된 비동기 작업 결과 반영 및 채팅 기록 렌더링
+deliver_async_results()
 render_chat_history()
-
-# 응답 생성 취소 버튼 렌더링
-render_cancel_button()
-
-# 사용자 입력
-prompt = st.chat_input("메시지를 입력하세요...", disabled=st.session_state.generating)
+render_generation_error()
+render_async_job_status()
+
+# 사용자 입력 (비동기 작업이 진행 중이면 결과가 질문 바로 뒤에 오도록 입력을 막음)
+async_pending = bool(async_job_store.pending(st.session_state.session_id))
+prompt = st.chat_input(
+    "비동기 작업이 끝나면 입력할 수 있습니다..." if async_pending else "메시지를 입력하세요...",
+    disabled=st.session_state.generating or async_pending,
+)
 
 # 사용자가 메시지를 입력했을 때
 if prompt:
     content = prompt
 
     # 파일 첨부 메시지 생성
-    file_message = create_file_attachment_message(st.session_state.uploaded_files)
+    file_message = create_file_attachment_message(resolve_uploaded_files())
     if file_message:
         #file_prompt = {"type": "image_url", "image_url": file_message}
         content = [{"type": "text", "text": prompt}] + file_message
 
-    # 사용자 메시지 추가 및 표시
-    st.session_state.messages.append({"role": "user", "content": content})
+    # 사용자 메시지 추가 및 표시 (첨부 항목은 세션 저장소에 보관)
+    st.session_state.messages.append({"role": "user", "content": store_message_content(content)})
     with st.chat_message("user"):
         st.write(prompt)
 
-    # 생성 상태 설정
-    st.session_state.generating = True
-    st.session_state.cancel_generation = False
-
-    # AI 응답 생성
-    with st.chat_message("assistant"):
-        message_placeholder = st.empty()
-
-        # 메시지 준비
-        messages = [{"role": "system", "content": system_message}]
-        messages.extend([
-            {"role": m["role"], "content": m["content"]}
-            for m in st.session_state.messages
-        ])
-
-        # MCP 서버 설정
-        # mcp_servers = []
-        # for server in st.session_state.mcp_servers:
-        #     mcp_servers.append({"url": server})
-
-        with st.spinner("생각 중..."):
-            # 스트리밍 응답 처리
-            try:
-                # 응답 생성
-                stream = perplexity_client.generate_stream_response(
-                    model=model,
-                    messages=messages,
-                    temperature=temperature,
-                    max_tokens=max_tokens,
-                    # use_mcp=st.session_state.enable_mcp,
-                    # mcp_servers=mcp_servers if mcp_servers else None
-                )
-
-                # 응답 처리 및 표시
-                full_response, metadata = process_stream_response(
-                    stream,
-                    message_placeholder,
-                    lambda: st.session_state.cancel_generation
-                )
-
-                # 메타데이터 표시
-                display_metadata(metadata)
-                st.session_state.metadata_history.append(metadata)
-
-            except Exception as e:
-                st.error(f"오류가 발생했습니다: {str(e)}")
-                raise e
-
-    # 생성 상태 해제
-    st.session_state.generating = False
-    st.session_state.cancel_generation = False
-
-    # AI 응답을 세션 상태에 저장
-    if full_response:  # 취소된 경우 빈 응답이 될 수 있음
-        st.session_state.messages.append({"role": "assistant", "content": full_response})
-
-    # 페이지 새로고침
+    # 메시지 준비 (지난 메시지는 캐시된 직렬화 바이트 재사용)
+    messages = build_request_messages(system_message)
+
+    # 자동 선택이면 프롬프트 특징과 관측된 첫 토큰 도착 시간으로 모델 결정
+    routing = None
+    if model == AUTO_MODEL:
+        routing = route_model(messages, max_tokens)
+        model = routing["model"]
+        st.caption(f"자동 모델 선택: {describe_routing(routing)}")
+    use_async = use_async and model == "sonar-deep-research"
+
+    # MCP 서버 설정
+    # mcp_servers = []
+    # for server in st.session_state.mcp_servers:
+    #     mcp_servers.append({"url": server})
+
+    # 요청 전 프롬프트 크기 추정 및 max_tokens 조정
+    try:
+        preflight = plan_max_tokens(model, messages, max_tokens)
+    except ValueError as e:
+        # 요청하지 않은 사용자 메시지는 대화 기록에서 제거
+        st.session_state.messages.pop()
+        st.error(str(e))
+        st.stop()
+
+    if use_async:
+        # 비동기 작업으로 제출하고 결과는 폴러가 회수한 뒤 대화에 전달
+        try:
+            submit_async_job(
+                perplexity_client, async_job_store, model, messages,
+                temperature, preflight["max_tokens"], st.session_state.session_id,
+                metadata={"preflight": preflight, "routing": routing},
+            )
+        except Exception as e:
+            st.session_state.messages.pop()
+            st.error(f"오류가 발생했습니다: {str(e)}")
+            st.stop()
+        st.rerun()
+
+    def start_stream():
+        # 워커 스레드에서 호출되므로 st.session_state에 접근하지 않음
+        return perplexity_client.generate_stream_response(
+            model=model,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=preflight["max_tokens"],
+            hedge=hedge,
+            # use_mcp=st.session_state.enable_mcp,
+            # mcp_servers=mcp_servers if mcp_servers else None
+        )
+
+    session_id = st.session_state.session_id
+
+    def record_usage(metadata):
+        # 응답이 끝나면 사용량 원장에 기록 (워커 스레드에서 호출)
+        metadata["preflight"] = preflight
+        if routing is not None:
+            metadata["routing"] = routing
+        usage_ledger.record(
+            session_id,
+            model,
+            metadata.get("usage"),
+            max_tokens=preflight["max_tokens"],
+            cancelled=metadata.get("cancelled", False),
+            prompt_estimate=preflight["prompt_tokens_estimate"],
+        )
+
+    # 백그라운드 작업으로 응답 생성 시작 (재실행/재연결 후에도 유지됨)
+    active_job = start_generation_job(start_stream, on_complete=record_usage)
+
+# 진행 중인 생성 작업에 연결하여 응답 표시
+if active_job is not None:
+    # 응답 생성 취소 버튼 렌더링 (생성 중에만 표시)
+    render_cancel_button()
+
+    # 작업이 끝나면 대화 기록/생성 상태가 바뀌었으므로 새로고침 (실패한 경우 오류는 새로고침 후 표시)
+    attach_generation_job(active_job)
     st.rerun()
 
 # 푸터